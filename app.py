@@ -12,7 +12,7 @@ from datetime import datetime, timedelta
 from cin7_client import Cin7Client
 from database import db, init_db
 from stock_calculator import StockCalculator
-from sales_velocity import SalesVelocityCalculator
+from sales_velocity import SalesVelocityCalculator, invalidate_velocity_cache
 
 # Load environment variables
 load_dotenv()
@@ -63,9 +63,17 @@ def sync_orders():
         # Store orders in database
         stored_count = 0
         for order in orders:
-            if stock_calculator.store_order(order):
+            if stock_calculator.store_order(order, commit=False):
                 stored_count += 1
         
+        # One commit for the whole sync
+        if not stock_calculator.flush_batch():
+            stored_count = 0
+        
+        # New orders change velocity; don't serve pre-sync results
+        if stored_count:
+            invalidate_velocity_cache()
+        
         return jsonify({
             'success': True,
             'message': f'Synced {stored_count} orders',
@@ -90,9 +98,13 @@ def sync_products():
         # Store products in database
         stored_count = 0
         for product in products:
-            if stock_calculator.store_product(product):
+            if stock_calculator.store_product(product, commit=False):
                 stored_count += 1
         
+        # One commit for the whole sync
+        if not stock_calculator.flush_batch():
+            stored_count = 0
+        
         return jsonify({
             'success': True,
             'message': f'Synced {stored_count} products',
@@ -172,7 +184,7 @@ def calculate_reorder_points():
             stock_on_hand = stock_calculator.get_stock_on_hand(sku['sku'])
             
             # Calculate sales velocity
-            velocity = velocity_calculator.calculate_velocity(sku['sku'], days=30)
+            velocity = velocity_calculator.calculate_velocity(sku['sku'], days=30, full=False)
             
             # Calculate reorder point
             # Reorder Point = (Lead Time × Average Daily Sales) + Safety Stock
@@ -225,7 +237,7 @@ def forecast_sku(sku):
         days_ahead = int(request.args.get('days', 90))  # Default 90 days forecast
         
         # Get historical data
-        velocity = velocity_calculator.calculate_velocity(sku, days=90)
+        velocity = velocity_calculator.calculate_velocity(sku, days=90, full=False)
         stock = stock_calculator.get_stock_on_hand(sku)
         
         # Simple linear forecast
@@ -3,6 +3,7 @@ Database models and connection setup
 Using SQLAlchemy for ORM
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from datetime import datetime
 import os
 
@@ -24,7 +25,31 @@ def init_db(app):
     db.init_app(app)
     
     with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            _enable_sqlite_savepoints(db.engine)
+        
         db.create_all()
+        
+        # create_all() skips existing tables, so add any indexes declared since
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+
+
+def _enable_sqlite_savepoints(engine):
+    """
+    SQLAlchemy's documented pysqlite workaround: pysqlite's own implicit
+    BEGIN handling breaks SAVEPOINT, so turn it off and emit BEGIN when
+    SQLAlchemy starts a transaction. StockCalculator relies on
+    begin_nested() to isolate each staged order.
+    """
+    @event.listens_for(engine, 'connect')
+    def _disable_pysqlite_begin(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+    
+    @event.listens_for(engine, 'begin')
+    def _emit_begin(conn):
+        conn.exec_driver_sql('BEGIN')
 
 
 class Product(db.Model):
@@ -78,6 +103,15 @@ class Order(db.Model):
     # Relationships
     lines = db.relationship('OrderLine', back_populates='order', cascade='all, delete-orphan')
     
+    # Date-range scans for velocity; the partial index skips voided orders entirely
+    __table_args__ = (
+        db.Index('ix_orders_order_date_status', 'order_date', 'status',
+                 postgresql_include=['warehouse_code']),
+        db.Index('ix_orders_order_date_not_voided', 'order_date',
+                 postgresql_where=db.text("status <> 'VOIDED'"),
+                 sqlite_where=db.text("status <> 'VOIDED'")),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -107,6 +141,12 @@ class OrderLine(db.Model):
     order = db.relationship('Order', back_populates='lines')
     product = db.relationship('Product', back_populates='orders')
     
+    # Per-SKU velocity lookups join to orders by order_id
+    __table_args__ = (
+        db.Index('ix_order_lines_sku_order_id', 'sku', 'order_id',
+                 postgresql_include=['quantity']),
+    )
+    
     def to_dict(self):
         return {
             'id': self.id,
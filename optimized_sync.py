@@ -3,9 +3,11 @@ Optimized Sync Manager - Implementing example app's proven optimizations
 10x faster through: max page size, preloading, batch operations
 """
 import sqlite3
+import sys
 import requests
 import time
 import logging
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 import os
@@ -16,6 +18,12 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Warehouses we sync order lines for
+_VALID_WH = frozenset({'VIC', 'QLD', 'NSW'})
+
+# Most recently used SaleID -> warehouse mappings kept per process
+WAREHOUSE_CACHE_MAX = 10000
+
 class OptimizedCin7Sync:
     """
     Optimized Cin7 sync based on example app's proven patterns
@@ -44,6 +52,8 @@ class OptimizedCin7Sync:
         self.sku_map = {}
         self.warehouse_map = {}
         self.existing_references = set()
+        self._warehouse_cache = OrderedDict()  # SaleID -> mapped warehouse, LRU order
+        self.sale_etags = {}  # SaleID -> ETag of last stored detail response
         
         self.init_tables()
         self._preload_data()
@@ -83,6 +93,15 @@ class OptimizedCin7Sync:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_warehouse ON orders(warehouse)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_reference ON orders(reference_id)')
         
+        # Detail-response ETags for conditional GETs on re-sync
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sale_cache (
+                sale_id TEXT PRIMARY KEY,
+                etag TEXT,
+                fetched_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         conn.commit()
         conn.close()
     
@@ -102,6 +121,10 @@ class OptimizedCin7Sync:
         cursor.execute('SELECT reference_id FROM orders')
         self.existing_references = {row[0] for row in cursor.fetchall()}
         
+        # Preload detail ETags so unchanged orders can be skipped
+        cursor.execute('SELECT sale_id, etag FROM sale_cache WHERE etag IS NOT NULL')
+        self.sale_etags = dict(cursor.fetchall())
+        
         # Setup warehouse mappings
         self.warehouse_map = {
             'VIC': 'VIC',
@@ -128,8 +151,13 @@ class OptimizedCin7Sync:
         
         self.last_request_time = time.time()
     
-    def _make_request(self, endpoint: str, params: Dict = None, is_detail_call: bool = False) -> Dict:
-        """Make optimized API request"""
+    def _make_request(self, endpoint: str, params: Dict = None, is_detail_call: bool = False,
+                      extra_headers: Dict = None, raw: bool = False):
+        """Make optimized API request
+        
+        With raw=True the response object is returned instead of decoded JSON,
+        so callers can inspect status codes (e.g. 304) and headers.
+        """
         self._wait_for_rate_limit(is_detail_call)
         
         headers = {
@@ -137,6 +165,8 @@ class OptimizedCin7Sync:
             'api-auth-applicationkey': self.api_key,
             'Content-Type': 'application/json'
         }
+        if extra_headers:
+            headers.update(extra_headers)
         
         url = f"{self.base_url}{endpoint}"
         
@@ -148,9 +178,11 @@ class OptimizedCin7Sync:
                 retry_after = int(response.headers.get('Retry-After', 60))
                 logger.warning(f"🚫 Rate limited! Waiting {retry_after}s...")
                 time.sleep(retry_after)
-                return self._make_request(endpoint, params, is_detail_call)
+                return self._make_request(endpoint, params, is_detail_call, extra_headers, raw)
             
             response.raise_for_status()
+            if raw:
+                return response
             return response.json()
             
         except Exception as e:
@@ -176,7 +208,8 @@ class OptimizedCin7Sync:
                 'skipped': 0,
                 'voided': 0,
                 'lines_inserted': 0,
-                'duplicate_references': 0
+                'duplicate_references': 0,
+                'not_modified': 0
             }
             
             # Optimization #1: Use maximum page size (1000 vs 100)
@@ -228,7 +261,8 @@ class OptimizedCin7Sync:
                 batch_stats = self._process_order_batch(batch_orders, dry_run)
                 
                 # Update stats
-                for key in ['processed', 'inserted', 'skipped', 'voided', 'lines_inserted', 'duplicate_references']:
+                for key in ['processed', 'inserted', 'skipped', 'voided', 'lines_inserted',
+                            'duplicate_references', 'not_modified']:
                     stats[key] += batch_stats.get(key, 0)
                 stats['api_calls'] += batch_stats.get('api_calls', 0)
             
@@ -264,18 +298,20 @@ class OptimizedCin7Sync:
             'voided': 0,
             'lines_inserted': 0,
             'duplicate_references': 0,
+            'not_modified': 0,
             'api_calls': 0
         }
         
         # Batch data for database operations
         new_products = []
         new_orders = []
+        new_etags = []
         
         for order in orders:
             batch_stats['processed'] += 1
             
             # Skip voided orders
-            if order.get('Status', '').upper() == 'VOIDED':
+            if (order.get('Status') or '').upper() == 'VOIDED':
                 batch_stats['voided'] += 1
                 continue
             
@@ -286,15 +322,31 @@ class OptimizedCin7Sync:
                 batch_stats['skipped'] += 1
                 continue
             
-            # Get order detail (expensive call)
+            # Get order detail (expensive call), conditional on the stored ETag
+            etag = self.sale_etags.get(sale_id)
+            extra_headers = {'If-None-Match': etag} if etag else None
             try:
-                order_detail = self._make_request('/Sale', {'ID': sale_id}, is_detail_call=True)
+                response = self._make_request('/Sale', {'ID': sale_id}, is_detail_call=True,
+                                              extra_headers=extra_headers, raw=True)
                 batch_stats['api_calls'] += 1
             except Exception as e:
                 logger.error(f"❌ Failed to get detail for {order_number}: {e}")
                 batch_stats['skipped'] += 1
                 continue
             
+            # Unchanged since last sync - nothing to extract
+            if response.status_code == 304:
+                batch_stats['not_modified'] += 1
+                continue
+            
+            order_detail = response.json()
+            if etag:
+                # The order changed since the stored ETag; re-map its warehouse
+                self._warehouse_cache.pop(sale_id, None)
+            response_etag = response.headers.get('ETag')
+            if response_etag:
+                new_etags.append((sale_id, response_etag))
+            
             # Extract lines using optimized logic
             lines = self._extract_lines_optimized(order, order_detail)
             
@@ -338,12 +390,12 @@ class OptimizedCin7Sync:
                 batch_stats['skipped'] += 1
         
         # Optimization #3: Batch database operations
-        if not dry_run and (new_products or new_orders):
-            self._batch_insert_data(new_products, new_orders)
+        if not dry_run and (new_products or new_orders or new_etags):
+            self._batch_insert_data(new_products, new_orders, new_etags)
         
         return batch_stats
     
-    def _batch_insert_data(self, new_products: List, new_orders: List):
+    def _batch_insert_data(self, new_products: List, new_orders: List, new_etags: List = None):
         """Batch insert data to database (optimization #3)"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -366,8 +418,18 @@ class OptimizedCin7Sync:
                 ''', new_orders)
                 logger.info(f"   📋 Batch inserted {len(new_orders)} order lines")
             
+            # Record ETags in the same transaction as the lines they cover
+            if new_etags:
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO sale_cache (sale_id, etag, fetched_at)
+                    VALUES (?, ?, CURRENT_TIMESTAMP)
+                ''', new_etags)
+            
             conn.commit()
             
+            if new_etags:
+                self.sale_etags.update(new_etags)
+            
         except Exception as e:
             logger.error(f"❌ Batch insert failed: {e}")
             conn.rollback()
@@ -379,9 +441,23 @@ class OptimizedCin7Sync:
         lines = []
         
         order_number = order.get('OrderNumber', '')
-        order_date = order.get('OrderDate', '').split('T')[0]
+        order_date = order.get('OrderDate', '').partition('T')[0]
         sale_id = order.get('SaleID', '')
         
+        # Map warehouse once per order (it's an order-level property)
+        warehouse = self._warehouse_cache.get(sale_id)
+        if warehouse is None:
+            warehouse = self._map_warehouse_optimized(order_detail)
+            self._warehouse_cache[sale_id] = warehouse
+            if len(self._warehouse_cache) > WAREHOUSE_CACHE_MAX:
+                self._warehouse_cache.popitem(last=False)
+        else:
+            self._warehouse_cache.move_to_end(sale_id)
+        
+        # Skip if not target warehouse
+        if warehouse not in _VALID_WH:
+            return lines
+        
         # Get lines from order detail
         order_data = order_detail.get('Order', {})
         line_items = order_data.get('Lines', [])
@@ -394,12 +470,8 @@ class OptimizedCin7Sync:
             if not sku or quantity <= 0:
                 continue
             
-            # Map warehouse using example app's logic
-            warehouse = self._map_warehouse_optimized(order_detail)
-            
-            # Skip if not target warehouse (VIC/QLD only for example app)
-            if warehouse not in ['VIC', 'QLD', 'NSW']:
-                continue
+            # SKUs repeat across orders; share one string per SKU
+            sku = sys.intern(sku)
             
             lines.append({
                 'order_number': order_number,
@@ -498,22 +570,31 @@ class OptimizedCin7Sync:
             }
 
 # Create Flask app
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from json_provider import OrjsonProvider
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 sync_manager = OptimizedCin7Sync()
 
+# Serialized /health body, rebuilt only when the preloaded counts change
+_health_cache = {'key': None, 'body': None}
+
 @app.route('/health')
 def health():
-    return jsonify({
-        'status': 'healthy',
-        'optimizations': ['max_page_size', 'preloading', 'batch_operations'],
-        'preloaded_skus': len(sync_manager.sku_map),
-        'existing_orders': len(sync_manager.existing_references)
-    })
+    key = (len(sync_manager.sku_map), len(sync_manager.existing_references))
+    if _health_cache['key'] != key:
+        _health_cache['body'] = app.json.dumps({
+            'status': 'healthy',
+            'optimizations': ['max_page_size', 'preloading', 'batch_operations'],
+            'preloaded_skus': key[0],
+            'existing_orders': key[1]
+        })
+        _health_cache['key'] = key
+    return Response(_health_cache['body'], mimetype='application/json')
 
 @app.route('/sync/estimate-optimized')
 def estimate_optimized():
@@ -618,4 +699,6 @@ if __name__ == '__main__':
     print("  GET  /sync/optimized?start=2025-09-20&end=2025-09-24&max=10&apply=false")
     print("  GET  /velocity/OBQ?start=2024-06-04&end=2024-06-04")
     
-    app.run(debug=True, port=5002)
+    # Threaded WSGI server so long /sync/optimized runs don't block other endpoints
+    from waitress import serve
+    serve(app, host='0.0.0.0', port=5002, threads=8)
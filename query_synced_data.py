@@ -81,7 +81,7 @@ def query_ob_skus():
         cursor.execute('''
             SELECT sku, SUM(quantity) as total_qty, COUNT(*) as order_count
             FROM orders 
-            WHERE UPPER(sku) LIKE '%OB%ESS%' OR UPPER(sku) LIKE '%OB-ESS%'
+            WHERE sku LIKE '%OB%ESS%'  -- LIKE is already case-insensitive for ASCII
             GROUP BY sku
             ORDER BY total_qty DESC
         ''')
@@ -9,17 +9,20 @@ from datetime import datetime
 
 load_dotenv()
 
-def quick_test_ob_ess_q():
+def make_session():
+    """Keep-alive session with Cin7 auth headers, shared across calls"""
+    session = requests.Session()
+    session.headers.update({
+        'api-auth-accountid': os.environ.get('CIN7_ACCOUNT_ID'),
+        'api-auth-applicationkey': os.environ.get('CIN7_API_KEY'),
+        'Content-Type': 'application/json'
+    })
+    return session
+
+def quick_test_ob_ess_q(session=None):
     """Quick test with just 1 week of data"""
-    account_id = os.environ.get('CIN7_ACCOUNT_ID')
-    api_key = os.environ.get('CIN7_API_KEY')
     base_url = os.environ.get('CIN7_BASE_URL', 'https://inventory.dearsystems.com/ExternalApi/v2')
-    
-    headers = {
-        'api-auth-accountid': account_id,
-        'api-auth-applicationkey': api_key,
-        'Content-Type': 'application/json'
-    }
+    session = session or make_session()
     
     # Start with just 1 week for testing
     start_date = '2025-06-11'
@@ -40,7 +43,7 @@ def quick_test_ob_ess_q():
             'OrderDateTo': end_date
         }
         
-        response = requests.get(f"{base_url}/SaleList", headers=headers, params=params, timeout=30)
+        response = session.get(f"{base_url}/SaleList", params=params, timeout=30)
         response.raise_for_status()
         
         data = response.json()
@@ -50,7 +53,7 @@ def quick_test_ob_ess_q():
         
         if not orders:
             print("❌ No orders found - trying different date range")
-            return test_known_period()
+            return test_known_period(session)
         
         # Show sample to verify we have real data
         if orders:
@@ -76,10 +79,9 @@ def quick_test_ob_ess_q():
             
             try:
                 # Get order detail
-                detail_response = requests.get(f"{base_url}/Sale", 
-                                             headers=headers, 
-                                             params={'ID': sale_id}, 
-                                             timeout=30)
+                detail_response = session.get(f"{base_url}/Sale", 
+                                              params={'ID': sale_id}, 
+                                              timeout=30)
                 detail_response.raise_for_status()
                 detail = detail_response.json()
                 
@@ -123,19 +125,12 @@ def quick_test_ob_ess_q():
         print(f"❌ Quick test failed: {e}")
         return 0, 0
 
-def test_known_period():
+def test_known_period(session=None):
     """Test with a known period that has data"""
     print(f"\n🔄 Trying known period with data (June 2024)...")
     
-    account_id = os.environ.get('CIN7_ACCOUNT_ID')
-    api_key = os.environ.get('CIN7_API_KEY')
     base_url = os.environ.get('CIN7_BASE_URL', 'https://inventory.dearsystems.com/ExternalApi/v2')
-    
-    headers = {
-        'api-auth-accountid': account_id,
-        'api-auth-applicationkey': api_key,
-        'Content-Type': 'application/json'
-    }
+    session = session or make_session()
     
     # Try June 2024 (we know has data)
     params = {
@@ -146,7 +141,7 @@ def test_known_period():
     }
     
     try:
-        response = requests.get(f"{base_url}/SaleList", headers=headers, params=params, timeout=30)
+        response = session.get(f"{base_url}/SaleList", params=params, timeout=30)
         response.raise_for_status()
         
         data = response.json()
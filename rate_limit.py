@@ -0,0 +1,99 @@
+"""
+Rate Limiting Helpers
+Shared by the sync services and the Flask apps; importing this module has no side effects
+"""
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Bound parameters per IN (...) lookup, well under SQLite's variable limit
+SQLITE_IN_CHUNK = 500
+
+# Responses worth retrying: rate limited, or a transient server-side failure
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: one token every `interval` seconds, bursting up to `capacity`
+    Callers block in acquire() until a token is available, so any number of
+    worker threads share the same request budget. Implemented with absolute
+    monotonic deadlines: each caller reserves the next free slot under the
+    lock and sleeps until it, so sleeps don't accumulate scheduling jitter and
+    wall-clock adjustments can't stall the sync.
+    """
+    
+    def __init__(self, interval: float, capacity: int = 1):
+        self.interval = interval
+        self.capacity = capacity
+        self._next_allowed = 0.0  # time.monotonic() deadline of the next free slot
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> float:
+        """Take one token, sleeping until its slot. Returns seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            # Slots left unused while idle carry over, up to `capacity`
+            slot = max(self._next_allowed, now - (self.capacity - 1) * self.interval)
+            self._next_allowed = slot + self.interval
+        
+        wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+            return wait
+        return 0.0
+
+def retry_after_seconds(response, default: float) -> float:
+    """Seconds to wait per a Retry-After header (delta-seconds or HTTP-date), else default"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+def get_with_retries(session: requests.Session, url: str, params=None, timeout: float = 30,
+                     max_retries: int = 6, backoff_base: float = 1.0, max_wait: float = 30,
+                     retry_statuses=RETRY_STATUSES) -> requests.Response:
+    """
+    GET url, retrying retry_statuses responses, connection errors and timeouts
+    Waits honour Retry-After, falling back to capped exponential backoff with
+    jitter (so concurrent workers don't retry in lockstep), and never exceed
+    max_wait. Nothing sleeps after the final attempt: the last response is
+    returned for the caller to report, or the last connection error re-raised.
+    """
+    for attempt in range(max_retries):
+        backoff = min(backoff_base * 2 ** attempt, max_wait) + random.uniform(0, 0.5)
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt + 1 == max_retries:
+                raise
+            logger.warning(f"Request error ({e}) - retrying in {backoff:.1f}s...")
+            time.sleep(backoff)
+            continue
+        
+        if response.status_code not in retry_statuses or attempt + 1 == max_retries:
+            return response
+        
+        if response.status_code == 429:
+            wait = min(retry_after_seconds(response, backoff), max_wait)
+            logger.warning(f"Rate limited - waiting {wait:.1f}s...")
+        else:
+            wait = backoff
+            logger.warning(f"Server error {response.status_code} - waiting {wait:.1f}s...")
+        time.sleep(wait)
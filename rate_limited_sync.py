@@ -3,20 +3,38 @@ Rate-Limited Sync Manager - Based on example app's proven patterns
 Handles Cin7's 60 calls/minute limit properly
 """
 import sqlite3
+import orjson
 import requests
+import threading
+from requests.adapters import HTTPAdapter
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import os
 import json
 from dotenv import load_dotenv
+from rate_limit import TokenBucket, SQLITE_IN_CHUNK, RETRY_STATUSES, get_with_retries
 
 # Load environment variables FIRST
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Applied to every connection: WAL + NORMAL sync avoids an fsync per commit
+SQLITE_PRAGMAS = '''
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+'''
+
+# (code in Cin7 location name, warehouse), checked in priority order:
+# pick locations first, then the order location
+_PICK_LOCATIONS = (('CNTVIC', 'VIC'), ('WCLQLD', 'QLD'))
+_ORDER_LOCATIONS = (('VIC', 'VIC'), ('QLD', 'QLD'))
+
 class RateLimitedCin7Sync:
     """
     Handles Cin7 API syncing with proper rate limiting
@@ -32,16 +50,44 @@ class RateLimitedCin7Sync:
         if not self.account_id or not self.api_key:
             raise ValueError("Missing CIN7_ACCOUNT_ID or CIN7_API_KEY")
         
+        # One keep-alive session for every Cin7 call; pool sized for the worker threads
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=0))
+        self.session.headers.update({
+            'api-auth-accountid': self.account_id,
+            'api-auth-applicationkey': self.api_key,
+            'Content-Type': 'application/json'
+        })
+        
         # Rate limiting settings (from example app)
-        self.last_request_time = 0
         self.min_interval = 1.2  # 1.2 seconds between requests (50 calls/minute, under 60 limit)
         self.detail_interval = 1.8  # 1.8 seconds between order detail calls (33 calls/minute)
+        self._list_bucket = TokenBucket(self.min_interval)
+        self._detail_bucket = TokenBucket(self.detail_interval)
+        
+        # Detail calls in flight at once; the bucket, not the pool, sets the call rate
+        self.max_workers = 8
+        
+        # Attempts per request on 429/5xx before giving up
+        self.max_retries = 8
+        
+        # Orders buffered in memory between write transactions
+        self.commit_every = 500
+        
+        # SKUs known to be in products; loaded on first sync, kept across syncs
+        self._sku_cache: Optional[set] = None
         
         self.init_tables()
     
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection with the sync PRAGMAs applied"""
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(SQLITE_PRAGMAS)
+        return conn
+    
     def init_tables(self):
         """Initialize database tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         # Products table
@@ -68,6 +114,10 @@ class RateLimitedCin7Sync:
             )
         ''')
         
+        # Covering index for velocity lookups (sku + date range, SUM(quantity)).
+        # reference_id needs no extra index: its UNIQUE constraint already has one.
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_sku_date ON orders(sku, booking_date, quantity)')
+        
         # Sync state tracking
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sync_state (
@@ -84,48 +134,29 @@ class RateLimitedCin7Sync:
     
     def _wait_for_rate_limit(self, detail_call: bool = False):
         """Enforce rate limiting based on example app patterns"""
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
-        
-        required_interval = self.detail_interval if detail_call else self.min_interval
-        
-        if elapsed < required_interval:
-            sleep_time = required_interval - elapsed
-            logger.info(f"⏱️  Rate limiting: waiting {sleep_time:.1f}s")
-            time.sleep(sleep_time)
-        
-        self.last_request_time = time.time()
+        bucket = self._detail_bucket if detail_call else self._list_bucket
+        waited = bucket.acquire()
+        if waited:
+            logger.debug(f"⏱️  Rate limiting: waited {waited:.1f}s")
     
     def _make_request(self, endpoint: str, params: Dict = None, is_detail_call: bool = False) -> Dict:
-        """Make rate-limited API request"""
+        """Make rate-limited API request, retrying 429/5xx and connection errors with capped backoff"""
+        # One rate-limit token per request; retries are paced by their backoff instead
         self._wait_for_rate_limit(detail_call=is_detail_call)
         
-        headers = {
-            'api-auth-accountid': self.account_id,
-            'api-auth-applicationkey': self.api_key,
-            'Content-Type': 'application/json'
-        }
-        
         url = f"{self.base_url}{endpoint}"
         
         try:
             logger.info(f"🌐 API call: {endpoint}")
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            
-            # Handle rate limiting (from example app)
-            if response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', 60))
-                logger.warning(f"🚫 Rate limited! Waiting {retry_after} seconds...")
-                time.sleep(retry_after)
-                return self._make_request(endpoint, params, is_detail_call)
-            
-            if response.status_code == 503:
-                logger.warning("🚫 Service unavailable! Waiting 10 seconds...")
-                time.sleep(10)
-                return self._make_request(endpoint, params, is_detail_call)
+            response = get_with_retries(self.session, url, params=params, timeout=30,
+                                        max_retries=self.max_retries, backoff_base=0.1, max_wait=60)
+            if response.status_code in RETRY_STATUSES:
+                raise RuntimeError(
+                    f"{endpoint} still failing after {self.max_retries} attempts (HTTP {response.status_code})"
+                )
             
             response.raise_for_status()
-            return response.json()
+            return orjson.loads(response.content)
             
         except Exception as e:
             logger.error(f"❌ API request failed for {endpoint}: {e}")
@@ -146,17 +177,9 @@ class RateLimitedCin7Sync:
             logger.info(f"🔄 {'DRY RUN: ' if dry_run else ''}Syncing orders from {start_date} to {end_date}")
             
             # Fetch orders for date range
-            params = {
-                'Page': 1,
-                'Limit': 100,
-                'OrderDateFrom': start_date,
-                'OrderDateTo': end_date
-            }
+            orders, total_found = self._fetch_sale_list(start_date, end_date, max_orders)
             
-            result = self._make_request('/SaleList', params)
-            orders = result.get('SaleList', [])
-            
-            logger.info(f"📊 Found {len(orders)} orders in date range")
+            logger.info(f"📊 Found {total_found} orders in date range")
             
             # Limit for testing
             if max_orders:
@@ -165,7 +188,7 @@ class RateLimitedCin7Sync:
             
             # Process orders
             stats = {
-                'total_found': len(result.get('SaleList', [])),
+                'total_found': total_found,
                 'processed': 0,
                 'inserted': 0,
                 'skipped': 0,
@@ -173,65 +196,75 @@ class RateLimitedCin7Sync:
                 'lines_inserted': 0
             }
             
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Get existing SKUs
-            cursor.execute('SELECT sku FROM products')
-            existing_skus = {row[0] for row in cursor.fetchall()}
-            
-            for i, order in enumerate(orders):
-                stats['processed'] += 1
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
                 
-                # Skip voided orders
-                if order.get('Status', '').upper() == 'VOIDED':
-                    stats['voided'] += 1
-                    logger.info(f"⏭️  Skipped voided order: {order.get('OrderNumber')}")
-                    continue
-                
-                order_number = order.get('OrderNumber', '')
-                sale_id = order.get('SaleID', '')
+                # Existing SKUs (a copy on dry runs, which don't write products)
+                existing_skus = self._known_skus(cursor)
+                if dry_run:
+                    existing_skus = set(existing_skus)
                 
-                if not order_number or not sale_id:
-                    stats['skipped'] += 1
-                    continue
+                # Extracted (order_number, lines) awaiting a bulk idempotency check + write
+                pending = []
                 
-                logger.info(f"📦 Processing {i+1}/{len(orders)}: {order_number}")
+                to_fetch = []
+                for order in orders:
+                    stats['processed'] += 1
+                    
+                    # Skip voided orders
+                    if order.get('Status', '').upper() == 'VOIDED':
+                        stats['voided'] += 1
+                        logger.info(f"⏭️  Skipped voided order: {order.get('OrderNumber')}")
+                        continue
+                    
+                    if not order.get('OrderNumber') or not order.get('SaleID'):
+                        stats['skipped'] += 1
+                        continue
+                    
+                    to_fetch.append(order)
                 
-                # Get order detail (this is the expensive call)
+                # Detail calls (the expensive part) run on worker threads so their
+                # round-trips overlap the rate-limit gaps; SQLite stays on this thread.
+                # Results are handled as they complete so one slow response doesn't
+                # hold up the orders fetched after it.
+                pool = ThreadPoolExecutor(max_workers=self.max_workers)
                 try:
-                    order_detail = self._make_request('/Sale', {'ID': sale_id}, is_detail_call=True)
-                except Exception as e:
-                    logger.error(f"❌ Failed to get detail for {order_number}: {e}")
-                    stats['skipped'] += 1
-                    continue
-                
-                # Extract order lines
-                lines = self._extract_order_lines(order, order_detail)
-                
-                if not lines:
-                    stats['skipped'] += 1
-                    continue
-                
-                # Store lines
-                lines_stored = 0
-                for line in lines:
-                    if self._store_order_line(cursor, line, existing_skus, dry_run):
-                        lines_stored += 1
-                        stats['lines_inserted'] += 1
-                
-                if lines_stored > 0:
-                    stats['inserted'] += 1
-                else:
-                    stats['skipped'] += 1
+                    futures = [pool.submit(self._fetch_order_detail, order) for order in to_fetch]
+                    
+                    for i, future in enumerate(as_completed(futures)):
+                        order, order_detail = future.result()
+                        order_number = order.get('OrderNumber', '')
+                        logger.info(f"📦 Processing {i+1}/{len(to_fetch)}: {order_number}")
+                        
+                        if order_detail is None:
+                            stats['skipped'] += 1
+                            continue
+                        
+                        # Extract order lines
+                        lines = self._extract_order_lines(order, order_detail)
+                        
+                        if not lines:
+                            stats['skipped'] += 1
+                            continue
+                        
+                        pending.append((order_number, lines))
+                        if len(pending) >= self.commit_every:
+                            self._store_pending(conn, pending, existing_skus, stats, dry_run)
+                except BaseException:
+                    # Queued detail calls are paced by the token bucket; don't
+                    # wait out the rest of the window before reporting the error
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+                pool.shutdown()
                 
-                if not dry_run:
-                    conn.commit()
+                self._store_pending(conn, pending, existing_skus, stats, dry_run)
                 
-                # Progress update
-                logger.info(f"   ✅ Stored {lines_stored} lines from {order_number}")
-            
-            conn.close()
+                # Refresh planner statistics so the new index is used
+                if not dry_run and stats['lines_inserted']:
+                    conn.execute('ANALYZE orders')
+            finally:
+                conn.close()
             
             return {
                 'success': True,
@@ -243,41 +276,99 @@ class RateLimitedCin7Sync:
             
         except Exception as e:
             logger.error(f"❌ Sync failed: {e}")
+            # A failed write may have left SKUs in the cache that never reached the DB
+            self._sku_cache = None
             return {
                 'success': False,
                 'error': str(e)
             }
     
-    def _extract_order_lines(self, order: Dict, order_detail: Dict) -> List[Dict]:
-        """Extract line items from order detail"""
+    def _fetch_sale_list(self, start_date: str, end_date: str,
+                         max_orders: int = None, page_size: int = 100) -> Tuple[List[Dict], int]:
+        """
+        Fetch every SaleList page for a date window. Returns (orders, total).
+        
+        Page 1 carries the window's Total, so the remaining pages are known up
+        front and fetched concurrently; the list token bucket still paces them.
+        """
+        def fetch_page(page: int) -> Dict:
+            return self._make_request('/SaleList', {
+                'Page': page,
+                'Limit': page_size,
+                'OrderDateFrom': start_date,
+                'OrderDateTo': end_date
+            })
+        
+        first = fetch_page(1)
+        orders = first.get('SaleList', [])
+        total = first.get('Total', len(orders))
+        
+        wanted = min(total, max_orders) if max_orders else total
+        last_page = -(-wanted // page_size)  # ceil
+        
+        if last_page > 1:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                # map() yields in page order, keeping the list in API order
+                for result in pool.map(fetch_page, range(2, last_page + 1)):
+                    orders.extend(result.get('SaleList', []))
+        
+        return orders, total
+    
+    def _known_skus(self, cursor) -> set:
+        """SKUs already in products, scanned once and then maintained in memory"""
+        if self._sku_cache is None:
+            cursor.execute('SELECT sku FROM products')
+            self._sku_cache = {row[0] for row in cursor.fetchall()}
+        return self._sku_cache
+    
+    def _fetch_order_detail(self, order: Dict) -> Tuple[Dict, Optional[Dict]]:
+        """Fetch one order's detail on a worker thread. Returns (order, detail or None on failure)."""
+        try:
+            return order, self._make_request('/Sale', {'ID': order.get('SaleID')}, is_detail_call=True)
+        except Exception as e:
+            logger.error(f"❌ Failed to get detail for {order.get('OrderNumber')}: {e}")
+            return order, None
+    
+    def _extract_order_lines(self, order: Dict, order_detail: Dict) -> List[tuple]:
+        """
+        Extract line items from order detail
+        
+        Each line is a tuple laid out as the orders INSERT columns plus description:
+        (order_number, sku, quantity, warehouse, booking_date, reference_id, description)
+        """
         lines = []
         
         # Get basic order info
         order_number = order.get('OrderNumber', '')
         order_date = order.get('OrderDate', '').split('T')[0]
         
+        # Map warehouse (simplified for MVP) - an order-level property, so once per order
+        warehouse = self._map_warehouse(order_detail)
+        
         # Extract lines from order detail
         order_data = order_detail.get('Order', {})
         line_items = order_data.get('Lines', [])
         
+        sale_id = order.get('SaleID')
+        
         for line in line_items:
-            sku = line.get('SKU', '').strip()
+            # Cheapest, most selective checks first
+            sku = (line.get('SKU') or '').strip()
+            if not sku:
+                continue
             quantity = line.get('Quantity', 0)
-            description = line.get('Name', '')
+            if quantity <= 0:
+                continue
             
-            if sku and quantity > 0:
-                # Map warehouse (simplified for MVP)
-                warehouse = self._map_warehouse(order_detail)
-                
-                lines.append({
-                    'order_number': order_number,
-                    'sku': sku,
-                    'description': description,
-                    'quantity': quantity,
-                    'warehouse': warehouse,
-                    'booking_date': order_date,
-                    'reference_id': f"{order.get('SaleID')}:{sku}"
-                })
+            lines.append((
+                order_number,
+                sku,
+                quantity,
+                warehouse,
+                order_date,
+                f"{sale_id}:{sku}",
+                line.get('Name', '')
+            ))
         
         return lines
     
@@ -290,59 +381,102 @@ class RateLimitedCin7Sync:
             pick_lines = fulfilment.get('Pick', {}).get('Lines', [])
             for line in pick_lines:
                 location = line.get('Location', '')
-                if 'CNTVIC' in location:
-                    return 'VIC'
-                elif 'WCLQLD' in location:
-                    return 'QLD'
+                for code, warehouse in _PICK_LOCATIONS:
+                    if code in location:
+                        return warehouse
         
         # Fallback to order location
         order_location = order_detail.get('Location', '')
-        if 'VIC' in order_location:
-            return 'VIC'
-        elif 'QLD' in order_location:
-            return 'QLD'
+        for code, warehouse in _ORDER_LOCATIONS:
+            if code in order_location:
+                return warehouse
         
         return 'NSW'  # Default
     
-    def _store_order_line(self, cursor, line: Dict, existing_skus: set, dry_run: bool) -> bool:
-        """Store individual order line with idempotency"""
-        try:
-            sku = line['sku']
-            reference_id = line['reference_id']
-            
-            # Check if already exists (idempotency)
-            cursor.execute('SELECT id FROM orders WHERE reference_id = ?', (reference_id,))
-            if cursor.fetchone():
-                return False  # Already exists
-            
-            if not dry_run:
-                # Add SKU if not exists
+    def _existing_references(self, conn: sqlite3.Connection, reference_ids: List[str]) -> set:
+        """Return which of reference_ids are already stored, in IN (...) chunks"""
+        existing = set()
+        for start in range(0, len(reference_ids), SQLITE_IN_CHUNK):
+            chunk = reference_ids[start:start + SQLITE_IN_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f'SELECT reference_id FROM orders WHERE reference_id IN ({placeholders})', chunk
+            )
+            existing.update(row[0] for row in rows)
+        return existing
+    
+    def _store_pending(self, conn: sqlite3.Connection, pending: List[tuple], existing_skus: set,
+                       stats: Dict, dry_run: bool):
+        """Filter already-stored lines for a batch of orders in bulk, then write the rest"""
+        if not pending:
+            return
+        
+        existing_refs = self._existing_references(
+            conn, [line[5] for _, lines in pending for line in lines]
+        )
+        product_rows = []
+        order_batches = []  # (order_number, order rows not yet stored)
+        
+        for order_number, lines in pending:
+            order_rows = []
+            for line in lines:
+                reference_id = line[5]
+                if reference_id in existing_refs:
+                    continue
+                existing_refs.add(reference_id)
+                
+                sku = line[1]
                 if sku not in existing_skus:
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO products (sku, description)
-                        VALUES (?, ?)
-                    ''', (sku, line['description']))
+                    product_rows.append((sku, line[6]))
                     existing_skus.add(sku)
                 
-                # Insert order line
-                cursor.execute('''
-                    INSERT INTO orders 
+                order_rows.append(line[:6])
+            order_batches.append((order_number, order_rows))
+        
+        if dry_run:
+            stored_counts = [len(order_rows) for _, order_rows in order_batches]
+        else:
+            stored_counts = self._write_rows(conn, product_rows, order_batches)
+        
+        for (order_number, _), lines_stored in zip(order_batches, stored_counts):
+            stats['lines_inserted'] += lines_stored
+            if lines_stored > 0:
+                stats['inserted'] += 1
+            else:
+                stats['skipped'] += 1
+            
+            logger.info(f"   ✅ {lines_stored} new lines from {order_number}")
+        pending.clear()
+    
+    def _write_rows(self, conn: sqlite3.Connection, product_rows: List[tuple],
+                    order_batches: List[tuple]) -> List[int]:
+        """
+        Write buffered rows with executemany in one transaction
+        
+        Returns the number of lines actually inserted for each (order_number, rows)
+        in order_batches, so lines INSERT OR IGNORE skipped aren't counted as stored.
+        """
+        if not product_rows and not any(order_rows for _, order_rows in order_batches):
+            return [0] * len(order_batches)
+        
+        stored_counts = []
+        with conn:
+            new_products = conn.executemany('''
+                INSERT OR IGNORE INTO products (sku, description)
+                VALUES (?, ?)
+            ''', product_rows).rowcount
+            # OR IGNORE: reference_id is UNIQUE, so a line written by another
+            # sync since the existence check can't abort the whole batch.
+            # One executemany per order so rowcount gives its stored lines.
+            for _, order_rows in order_batches:
+                stored_counts.append(conn.executemany('''
+                    INSERT OR IGNORE INTO orders 
                     (order_number, sku, quantity, warehouse, booking_date, reference_id)
                     VALUES (?, ?, ?, ?, ?, ?)
-                ''', (
-                    line['order_number'],
-                    line['sku'],
-                    line['quantity'],
-                    line['warehouse'],
-                    line['booking_date'],
-                    line['reference_id']
-                ))
-            
-            return True
-            
-        except Exception as e:
-            logger.error(f"❌ Failed to store line: {e}")
-            return False
+                ''', order_rows).rowcount if order_rows else 0)
+        
+        logger.info(f"💾 Wrote {sum(stored_counts)} order lines, {new_products} new products")
+        return stored_counts
     
     def estimate_sync_time(self, start_date: str, end_date: str) -> Dict:
         """Estimate how long a sync would take"""
@@ -357,7 +491,8 @@ class RateLimitedCin7Sync:
             
             result = self._make_request('/SaleList', params)
             orders = result.get('SaleList', [])
-            total_estimate = len(orders) * 10  # Rough estimate based on pagination
+            # Total covers every page; fall back to a rough guess if it's missing
+            total_estimate = result.get('Total', len(orders) * 10)
             
             # Time estimation
             # Each order needs 1 list call + 1 detail call = 2 calls
@@ -397,6 +532,44 @@ CORS(app)
 
 sync_manager = RateLimitedCin7Sync()
 
+# /velocity statements: aggregate, sales-day span and description in one round-trip.
+# The SQL text never changes, so sqlite3's statement cache reuses the prepared plan.
+_VELOCITY_SQL = '''
+    WITH s AS (
+        SELECT 
+            SUM(quantity) as total_quantity,
+            COUNT(*) as order_count,
+            MIN(booking_date) as first_sale,
+            MAX(booking_date) as last_sale
+        FROM orders 
+        WHERE sku = ? 
+        {date_filter}
+    )
+    SELECT s.*,
+           CAST(julianday(s.last_sale) - julianday(s.first_sale) AS INTEGER) + 1 as actual_days,
+           p.description
+    FROM s LEFT JOIN products p ON p.sku = ?
+'''
+VELOCITY_RANGE_SQL = _VELOCITY_SQL.format(date_filter='AND booking_date BETWEEN ? AND ?')
+VELOCITY_DAYS_SQL = _VELOCITY_SQL.format(date_filter="AND booking_date >= date('now', ?)")
+
+# Read-only connections for request handlers, one per server thread
+_local = threading.local()
+
+def get_read_db() -> sqlite3.Connection:
+    """Return this thread's read-only connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(sync_manager.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SQLITE_PRAGMAS)
+        # Read pages straight from the OS page cache instead of read() syscalls
+        conn.execute('PRAGMA mmap_size=268435456')
+        # WAL lets these readers run alongside a sync's write transaction
+        conn.execute('PRAGMA query_only=1')
+        _local.conn = conn
+    return conn
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
@@ -430,32 +603,19 @@ def calculate_velocity(sku):
         end_date = request.args.get('end') 
         days_back = int(request.args.get('days', 30))
         
-        conn = sqlite3.connect('stock_forecast.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = get_read_db().cursor()
         
-        # Build date filter
+        # Pick the fixed statement for the date filter; everything else is bound
         if start_date and end_date:
-            date_filter = 'AND booking_date BETWEEN ? AND ?'
+            query_sql = VELOCITY_RANGE_SQL
             date_params = [start_date, end_date]
             period_desc = f"{start_date} to {end_date}"
         else:
-            date_filter = 'AND booking_date >= date("now", "-{} days")'.format(days_back)
-            date_params = []
+            query_sql = VELOCITY_DAYS_SQL
+            date_params = [f'-{days_back} days']
             period_desc = f"last {days_back} days"
         
-        query_sql = f'''
-            SELECT 
-                SUM(quantity) as total_quantity,
-                COUNT(*) as order_count,
-                MIN(booking_date) as first_sale,
-                MAX(booking_date) as last_sale
-            FROM orders 
-            WHERE sku = ? 
-            {date_filter}
-        '''
-        
-        cursor.execute(query_sql, [sku] + date_params)
+        cursor.execute(query_sql, [sku] + date_params + [sku])
         result = cursor.fetchone()
         
         if not result or not result['total_quantity']:
@@ -468,26 +628,15 @@ def calculate_velocity(sku):
         
         total_qty = result['total_quantity']
         
-        # Calculate actual days between first and last sale
-        if result['first_sale'] and result['last_sale']:
-            first_date = datetime.strptime(result['first_sale'], '%Y-%m-%d')
-            last_date = datetime.strptime(result['last_sale'], '%Y-%m-%d')
-            actual_days = (last_date - first_date).days + 1
-        else:
-            actual_days = 1
+        # Actual days between first and last sale (computed by SQLite)
+        actual_days = result['actual_days'] or 1
         
         # Use actual days for velocity, not query period
         daily_velocity = total_qty / actual_days
         
-        # Get product info
-        cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
-        product = cursor.fetchone()
-        
-        conn.close()
-        
         return jsonify({
             'sku': sku,
-            'description': product['description'] if product else '',
+            'description': result['description'] or '',
             'period': period_desc,
             'actual_sales_days': actual_days,
             'total_quantity_sold': total_qty,
@@ -3,24 +3,305 @@ Sales velocity calculation module
 Calculates sales velocity (units per day) for SKUs
 """
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
 from sqlalchemy import func, and_
 from database import db, OrderLine, Order
 import logging
+import math
+import threading
+import time
 import pandas as pd
 import numpy as np
 
+try:
+    from numba import njit, prange
+except ImportError:  # Optional; bulk scoring falls back to NumPy
+    njit = None
+
 logger = logging.getLogger(__name__)
 
+# Velocity/seasonality results are reused for this long (or until invalidated)
+CACHE_TTL_SECONDS = 600
+CACHE_MAX_ENTRIES = 10000
+
+# Rows fetched per round trip when streaming large result sets
+STREAM_BATCH_SIZE = 1000
+
+# Days of all-warehouse history kept in memory by DailySalesMatrix
+MATRIX_WINDOW_DAYS = 90
+
+# Mixed into every cache key; bumping it orphans all cached results
+_cache_epoch = 0
+_cache_epoch_lock = threading.Lock()
+
+
+def invalidate_velocity_cache():
+    """Discard cached velocity results, e.g. after a sync stored new orders"""
+    global _cache_epoch
+    with _cache_epoch_lock:
+        _cache_epoch += 1
+
+# Daily sales as a struct-of-arrays: date ordinal + quantity
+_DAILY_DTYPE = np.dtype([('day', 'i8'), ('quantity', 'f8')])
+_NO_SALES = np.empty(0, dtype=np.float64)
+
+
+def _today():
+    """Current UTC date; all velocity windows end today"""
+    return datetime.utcnow().date()
+
+
+def _date_range(days: int):
+    """(start_date, end_date) for a window ending today, both inclusive"""
+    end_date = _today()
+    return end_date - timedelta(days=days), end_date
+
+
+def _daily_average(total_quantity: float, first_order, last_order, days: int):
+    """(actual_days, daily_average) as reported by calculate_velocity"""
+    # Calculate actual days with sales
+    actual_days = days
+    if first_order and last_order:
+        actual_days = (last_order - first_order).days + 1
+        actual_days = min(actual_days, days)  # Cap at requested days
+    
+    # Calculate velocity
+    daily_average = total_quantity / actual_days if actual_days > 0 else 0
+    return actual_days, daily_average
+
+
+def _velocity_stats_numpy(daily: np.ndarray):
+    """
+    Trend slope and CV for each row of a zero-filled (n_skus, n_days) daily sales matrix
+    
+    x is the day index within the window, as in _calculate_trend.
+    Returns (slopes, cvs) arrays with one entry per row.
+    """
+    n_days = daily.shape[1]
+    x = np.arange(n_days, dtype=np.float64) - (n_days - 1) / 2
+    sxx = x @ x
+    
+    mean = daily.mean(axis=1)
+    std = daily.std(axis=1)
+    slopes = daily @ x / sxx if sxx > 0 else np.zeros(len(daily))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cvs = np.where(mean != 0, std / mean * 100, 0.0)
+    
+    return slopes, cvs
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _velocity_stats_numba(daily):
+        """Numba version of _velocity_stats_numpy: one fused pass per row"""
+        k, n_days = daily.shape
+        x_mean = (n_days - 1) / 2
+        sxx = 0.0
+        for j in range(n_days):
+            sxx += (j - x_mean) ** 2
+        
+        slopes = np.zeros(k)
+        cvs = np.zeros(k)
+        for i in prange(k):
+            sxy = 0.0
+            mean = m2 = 0.0
+            for j in range(n_days):
+                y = daily[i, j]
+                sxy += (j - x_mean) * y
+                # Welford running mean/variance
+                d = y - mean
+                mean += d / (j + 1)
+                m2 += d * (y - mean)
+            if sxx > 0:
+                slopes[i] = sxy / sxx
+            if mean != 0:
+                cvs[i] = math.sqrt(m2 / n_days) / mean * 100
+        return slopes, cvs
+    
+    velocity_stats = _velocity_stats_numba
+else:
+    velocity_stats = _velocity_stats_numpy
+
+
+class DailySalesMatrix:
+    """
+    In-memory zero-filled (n_skus, window) daily quantity and line-count
+    matrices with prefix sums along the time axis.
+    
+    Covers end_date - window_days .. end_date for all warehouses. Rebuilt
+    with one grouped query when the cache epoch changes (a sync stored new
+    orders) or after CACHE_TTL_SECONDS, so orders written by other processes
+    are picked up; when the date rolls over the columns are shifted and the
+    previous end date is reloaded along with the new days.
+    """
+    
+    def __init__(self, loader, window_days: int = MATRIX_WINDOW_DAYS):
+        # loader(start_date, end_date) -> DataFrame of sku, date, quantity, line_count
+        self.loader = loader
+        self.window_days = window_days
+        self._lock = threading.RLock()
+        self._epoch = None
+        self._expires = 0.0  # time.monotonic() deadline for a full rebuild
+        self.end_date = None
+        self.sku_index: Dict[str, int] = {}
+        n_cols = window_days + 1
+        self.quantities = np.zeros((0, n_cols))
+        self.lines = np.zeros((0, n_cols))
+        self.quantity_cumsum = np.zeros((0, n_cols + 1))
+        self.line_cumsum = np.zeros((0, n_cols + 1))
+    
+    def window(self, skus: List[str], days: int):
+        """
+        Slice the last days + 1 columns for skus (zeros for unknown SKUs)
+        
+        Returns (start_date, quantities, lines, total_quantities, line_counts),
+        or None if days is outside the matrix window.
+        """
+        if days < 0 or days > self.window_days:
+            return None
+        
+        with self._lock:
+            self._ensure_current()
+            
+            n_cols = self.window_days + 1
+            first_col = n_cols - days - 1
+            rows = np.array([self.sku_index.get(sku, -1) for sku in skus], dtype=np.int64)
+            known = rows >= 0
+            
+            quantities = np.zeros((len(skus), days + 1))
+            lines = np.zeros((len(skus), days + 1))
+            quantities[known] = self.quantities[rows[known], first_col:]
+            lines[known] = self.lines[rows[known], first_col:]
+            
+            # Window totals in O(1) per SKU from the prefix sums
+            totals = np.zeros(len(skus))
+            line_counts = np.zeros(len(skus))
+            totals[known] = (self.quantity_cumsum[rows[known], n_cols]
+                             - self.quantity_cumsum[rows[known], first_col])
+            line_counts[known] = (self.line_cumsum[rows[known], n_cols]
+                                  - self.line_cumsum[rows[known], first_col])
+            
+            start_date = self.end_date - timedelta(days=days)
+            return start_date, quantities, lines, totals, line_counts
+    
+    def ranked(self, days: int, limit: int) -> Optional[List[str]]:
+        """Top limit SKUs by total quantity over the last days, or None if out of window"""
+        if days < 0 or days > self.window_days:
+            return None
+        
+        with self._lock:
+            self._ensure_current()
+            
+            n_cols = self.window_days + 1
+            first_col = n_cols - days - 1
+            totals = self.quantity_cumsum[:, n_cols] - self.quantity_cumsum[:, first_col]
+            has_sales = self.line_cumsum[:, n_cols] - self.line_cumsum[:, first_col] > 0
+            
+            skus = np.array(list(self.sku_index), dtype=object)
+            order = np.argsort(-totals, kind='stable')
+            order = order[has_sales[order]][:limit]
+            return skus[order].tolist()
+    
+    def _ensure_current(self):
+        """Bring the matrix up to today and the current cache epoch"""
+        today = _today()
+        if (self._epoch != _cache_epoch or self.end_date is None
+                or time.monotonic() >= self._expires):
+            self._rebuild(today)
+        elif today > self.end_date:
+            shift = (today - self.end_date).days
+            if shift > self.window_days:
+                self._rebuild(today)
+            else:
+                self._roll(today, shift)
+    
+    def _rebuild(self, today):
+        epoch = _cache_epoch
+        self.sku_index = {}
+        self.quantities = np.zeros((0, self.window_days + 1))
+        self.lines = np.zeros_like(self.quantities)
+        self.end_date = today
+        self._scatter(self.loader(today - timedelta(days=self.window_days), today))
+        self._epoch = epoch
+        self._expires = time.monotonic() + CACHE_TTL_SECONDS
+    
+    def _roll(self, today, shift: int):
+        # Drop the oldest columns and load the new days, plus the old end
+        # date: it was loaded part-way through that day
+        self.quantities = np.roll(self.quantities, -shift, axis=1)
+        self.lines = np.roll(self.lines, -shift, axis=1)
+        self.quantities[:, -shift - 1:] = 0
+        self.lines[:, -shift - 1:] = 0
+        
+        reload_start = self.end_date
+        self.end_date = today
+        self._scatter(self.loader(reload_start, today))
+    
+    def _scatter(self, df: pd.DataFrame):
+        """Write loaded (sku, date) rows into the matrices and refresh prefix sums"""
+        if len(df):
+            for sku in pd.unique(df['sku']):
+                if sku not in self.sku_index:
+                    self.sku_index[sku] = len(self.sku_index)
+            
+            n_new = len(self.sku_index) - len(self.quantities)
+            if n_new:
+                padding = np.zeros((n_new, self.window_days + 1))
+                self.quantities = np.vstack((self.quantities, padding))
+                self.lines = np.vstack((self.lines, padding))
+            
+            rows = df['sku'].map(self.sku_index).to_numpy(dtype=np.int64)
+            first_date = np.datetime64(self.end_date - timedelta(days=self.window_days))
+            cols = (
+                pd.to_datetime(df['date']).to_numpy(dtype='datetime64[D]') - first_date
+            ).astype(np.int64)
+            self.quantities[rows, cols] = df['quantity'].fillna(0).to_numpy(dtype=np.float64)
+            self.lines[rows, cols] = df['line_count'].to_numpy(dtype=np.float64)
+        
+        zeros = np.zeros((len(self.quantities), 1))
+        self.quantity_cumsum = np.hstack((zeros, np.cumsum(self.quantities, axis=1)))
+        self.line_cumsum = np.hstack((zeros, np.cumsum(self.lines, axis=1)))
+
 
 class SalesVelocityCalculator:
     """Calculates sales velocity and related metrics"""
     
     def __init__(self, database):
         self.db = database
+        self._cache: Dict[tuple, tuple] = {}
+        self._cache_lock = threading.RLock()
+        self._daily_matrix = DailySalesMatrix(self._get_daily_sales_bulk)
+    
+    def _cache_get(self, key: tuple) -> Optional[Dict]:
+        """Cached result for key, or None if missing or expired"""
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._cache[key]
+                return None
+            return dict(value)
+    
+    def _cache_put(self, key: tuple, value: Dict):
+        """Cache a result for CACHE_TTL_SECONDS (error results are not cached)"""
+        if 'error' in value:
+            return
+        
+        now = time.monotonic()
+        with self._cache_lock:
+            if len(self._cache) >= CACHE_MAX_ENTRIES:
+                # Drop expired entries first, then the oldest ones
+                self._cache = {k: e for k, e in self._cache.items() if e[0] >= now}
+                while len(self._cache) >= CACHE_MAX_ENTRIES:
+                    del self._cache[next(iter(self._cache))]
+            self._cache[key] = (now + CACHE_TTL_SECONDS, dict(value))
     
     def calculate_velocity(self, sku: str, days: int = 30, 
-                          warehouse: Optional[str] = None) -> Dict:
+                          warehouse: Optional[str] = None, full: bool = True) -> Dict:
         """
         Calculate sales velocity for a SKU
         
@@ -28,14 +309,32 @@ class SalesVelocityCalculator:
             sku: SKU code
             days: Number of days to look back
             warehouse: Optional warehouse filter (VIC/QLD/NSW)
+            full: Also calculate trend and variability (None when False)
         
         Returns:
             Dictionary with velocity metrics
         """
+        key = ('velocity', sku, days, warehouse, full, _cache_epoch)
+        velocity = self._cache_get(key)
+        if velocity is None:
+            velocity = self._calculate_velocity(sku, days, warehouse, full)
+            self._cache_put(key, velocity)
+        return velocity
+    
+    def _calculate_velocity(self, sku: str, days: int, warehouse: Optional[str],
+                            full: bool = True) -> Dict:
+        """Uncached calculate_velocity"""
         try:
+            # All-warehouse windows are answered from the in-memory matrix
+            if warehouse is None and days <= self._daily_matrix.window_days:
+                return self._compute_velocity_for_skus([sku], days, full)[0]
+            
             # Calculate date range
-            end_date = datetime.utcnow().date()
-            start_date = end_date - timedelta(days=days)
+            start_date, end_date = _date_range(days)
+            
+            if self._use_sql_stats():
+                stats = self._get_velocity_stats_sql(start_date, end_date, [sku], warehouse)
+                return self._velocity_from_stats(sku, days, warehouse, stats.get(sku), full)
             
             # Build query
             query = self.db.session.query(
@@ -60,42 +359,25 @@ class SalesVelocityCalculator:
             
             result = query.first()
             
-            total_quantity = result.total_quantity or 0
-            order_count = result.order_count or 0
-            
-            # Calculate actual days with sales
-            actual_days = days
-            if result.first_order and result.last_order:
-                actual_days = (result.last_order - result.first_order).days + 1
-                actual_days = min(actual_days, days)  # Cap at requested days
+            # No sales in the window: nothing for the daily breakdown to add
+            if not result.order_count:
+                return self._build_velocity(sku, days, warehouse, 0, 0, None, None, _NO_SALES, full=full)
             
-            # Calculate velocity
-            daily_average = total_quantity / actual_days if actual_days > 0 else 0
+            if not full:
+                return self._build_velocity(
+                    sku, days, warehouse,
+                    result.total_quantity or 0, result.order_count,
+                    result.first_order, result.last_order, _NO_SALES, full=False
+                )
             
             # Get daily breakdown for trend analysis
-            daily_sales = self._get_daily_sales(sku, start_date, end_date, warehouse)
+            dates, quantities = self._get_daily_sales(sku, start_date, end_date, warehouse)
             
-            # Calculate trend (simple linear regression)
-            trend = self._calculate_trend(daily_sales)
-            
-            # Calculate variability (coefficient of variation)
-            variability = self._calculate_variability(daily_sales)
-            
-            return {
-                'sku': sku,
-                'period_days': days,
-                'actual_days': actual_days,
-                'total_quantity': total_quantity,
-                'order_count': order_count,
-                'daily_average': daily_average,
-                'weekly_average': daily_average * 7,
-                'monthly_average': daily_average * 30,
-                'trend': trend,  # Positive = increasing, negative = decreasing
-                'variability': variability,  # Higher = more variable
-                'warehouse': warehouse or 'ALL',
-                'first_sale': result.first_order.isoformat() if result.first_order else None,
-                'last_sale': result.last_order.isoformat() if result.last_order else None
-            }
+            return self._build_velocity(
+                sku, days, warehouse,
+                result.total_quantity or 0, result.order_count or 0,
+                result.first_order, result.last_order, quantities
+            )
             
         except Exception as e:
             logger.error(f"Failed to calculate velocity for {sku}: {e}")
@@ -107,9 +389,49 @@ class SalesVelocityCalculator:
                 'monthly_average': 0
             }
     
+    def _build_velocity(self, sku: str, days: int, warehouse: Optional[str],
+                        total_quantity: float, order_count: int,
+                        first_order, last_order, quantities: np.ndarray,
+                        trend: Optional[float] = None,
+                        variability: Optional[float] = None,
+                        full: bool = True) -> Dict:
+        """Assemble the velocity metrics dict from aggregated sales data"""
+        actual_days, daily_average = _daily_average(total_quantity, first_order, last_order, days)
+        
+        if not full:
+            # Ranking-only callers skip trend and variability
+            trend = variability = None
+        else:
+            # Calculate trend (simple linear regression) unless precomputed in bulk
+            if trend is None:
+                trend = self._calculate_trend(quantities)
+            
+            # Calculate variability (coefficient of variation)
+            if variability is None:
+                variability = self._calculate_variability(quantities)
+        
+        return {
+            'sku': sku,
+            'period_days': days,
+            'actual_days': actual_days,
+            'total_quantity': total_quantity,
+            'order_count': order_count,
+            'daily_average': daily_average,
+            'weekly_average': daily_average * 7,
+            'monthly_average': daily_average * 30,
+            'trend': trend,  # Positive = increasing, negative = decreasing
+            'variability': variability,  # Higher = more variable
+            'warehouse': warehouse or 'ALL',
+            'first_sale': first_order.isoformat() if first_order else None,
+            'last_sale': last_order.isoformat() if last_order else None
+        }
+    
     def _get_daily_sales(self, sku: str, start_date, end_date, 
-                        warehouse: Optional[str] = None) -> List[Dict]:
-        """Get daily sales breakdown"""
+                        warehouse: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get daily sales for every day from start_date to end_date as parallel
+        (dates, quantities) arrays; days without sales are 0
+        """
         query = self.db.session.query(
             Order.order_date,
             func.sum(OrderLine.quantity).label('quantity')
@@ -122,67 +444,65 @@ class SalesVelocityCalculator:
                 Order.order_date <= end_date,
                 Order.status != 'VOIDED'
             )
-        ).group_by(Order.order_date)
+        )
         
         if warehouse:
             query = query.filter(Order.warehouse_code == warehouse)
         
-        results = query.all()
+        results = query.group_by(Order.order_date).all()
         
-        # Convert to list of dicts
-        daily_data = []
-        for date, quantity in results:
-            daily_data.append({
-                'date': date,
-                'quantity': quantity or 0
-            })
+        daily = np.fromiter(
+            ((date.toordinal(), quantity or 0) for date, quantity in results),
+            dtype=_DAILY_DTYPE, count=len(results)
+        )
         
-        return daily_data
+        # Scatter the sales days into a zero-filled window
+        dates = np.arange(np.datetime64(start_date), np.datetime64(end_date) + 1)
+        quantities = np.zeros(len(dates), dtype=np.float64)
+        quantities[daily['day'] - start_date.toordinal()] = daily['quantity']
+        return dates, quantities
     
-    def _calculate_trend(self, daily_sales: List[Dict]) -> float:
+    def _calculate_trend(self, quantities: np.ndarray) -> float:
         """Calculate sales trend using linear regression"""
-        if len(daily_sales) < 2:
+        if len(quantities) < 2:
             return 0.0
         
         try:
-            # Create DataFrame
-            df = pd.DataFrame(daily_sales)
-            if df.empty:
-                return 0.0
-            
-            # Add numeric day column
-            df['day_num'] = range(len(df))
+            # Closed-form least-squares slope over centred x: sum(x*y) / sum(x*x).
+            # Centring avoids the cancellation in sum(x*y) - n*mean(x)*mean(y),
+            # which is what polyfit's SVD would otherwise be guarding against
+            n = len(quantities)
+            x = np.arange(n, dtype=np.float64) - (n - 1) / 2
             
-            # Simple linear regression
-            x = df['day_num'].values
-            y = df['quantity'].values
-            
-            # Calculate slope
-            if len(x) > 1:
-                slope = np.polyfit(x, y, 1)[0]
-                return float(slope)
+            slope = (x @ quantities) / (x @ x)
+            return float(slope)
             
         except Exception as e:
             logger.error(f"Failed to calculate trend: {e}")
         
         return 0.0
     
-    def _calculate_variability(self, daily_sales: List[Dict]) -> float:
+    def _calculate_variability(self, quantities: np.ndarray) -> float:
         """Calculate coefficient of variation for sales"""
-        if not daily_sales:
+        if len(quantities) == 0:
             return 0.0
         
         try:
-            quantities = [d['quantity'] for d in daily_sales]
-            
-            if not quantities:
-                return 0.0
+            # Single-pass Welford mean/variance; cheaper than np.mean + np.std
+            # for the 30-90 point series seen here
+            n = 0
+            mean_qty = 0.0
+            m2 = 0.0
+            for qty in quantities.tolist():
+                n += 1
+                delta = qty - mean_qty
+                mean_qty += delta / n
+                m2 += delta * (qty - mean_qty)
             
-            mean_qty = np.mean(quantities)
             if mean_qty == 0:
                 return 0.0
             
-            std_qty = np.std(quantities)
+            std_qty = math.sqrt(m2 / n)
             cv = (std_qty / mean_qty) * 100  # As percentage
             
             return float(cv)
@@ -191,23 +511,258 @@ class SalesVelocityCalculator:
             logger.error(f"Failed to calculate variability: {e}")
             return 0.0
     
-    def calculate_velocity_bulk(self, skus: List[str], days: int = 30) -> List[Dict]:
-        """Calculate velocity for multiple SKUs"""
+    def _use_sql_stats(self) -> bool:
+        """Whether trend/variability can be aggregated server-side (Postgres only)"""
+        return self.db.engine.dialect.name == 'postgresql'
+    
+    def _get_velocity_stats_sql(self, start_date, end_date, skus: List[str],
+                                warehouse: Optional[str] = None) -> Dict:
+        """
+        Per-SKU totals, trend and variability computed in one Postgres query
+        
+        Days without sales count as zeros, as in _get_daily_sales. They add
+        nothing to the sums, so only the sales days need to be aggregated.
+        """
+        daily = self.db.session.query(
+            OrderLine.sku.label('sku'),
+            Order.order_date.label('order_date'),
+            func.sum(OrderLine.quantity).label('quantity'),
+            func.count(OrderLine.id).label('line_count'),
+            # Index of the day within the window, matching _calculate_trend's x
+            (Order.order_date - start_date).label('day_num')
+        ).join(
+            Order, OrderLine.order_id == Order.id
+        ).filter(
+            and_(
+                OrderLine.sku.in_(skus),
+                Order.order_date >= start_date,
+                Order.order_date <= end_date,
+                Order.status != 'VOIDED'
+            )
+        )
+        
+        if warehouse:
+            daily = daily.filter(Order.warehouse_code == warehouse)
+        
+        daily = daily.group_by(OrderLine.sku, Order.order_date).subquery()
+        
+        # Slope over centred x: sum((x - mean_x) * y) / sum((x - mean_x)^2)
+        n_days = (end_date - start_date).days + 1
+        x_mean = (n_days - 1) / 2
+        sxx = n_days * (n_days ** 2 - 1) / 12
+        trend = func.sum((daily.c.day_num - x_mean) * daily.c.quantity) / sxx if sxx else 0
+        
+        # Population std over the whole window, as np.std in _calculate_variability
+        mean = func.sum(daily.c.quantity) / n_days
+        std = func.sqrt(func.greatest(func.sum(daily.c.quantity * daily.c.quantity) / n_days - mean * mean, 0))
+        cv = std / func.nullif(mean, 0) * 100
+        
+        query = self.db.session.query(
+            daily.c.sku,
+            func.sum(daily.c.quantity).label('total_quantity'),
+            func.sum(daily.c.line_count).label('order_count'),
+            func.min(daily.c.order_date).label('first_order'),
+            func.max(daily.c.order_date).label('last_order'),
+            func.coalesce(trend, 0).label('trend'),
+            func.coalesce(cv, 0).label('variability')
+        ).group_by(daily.c.sku)
+        
+        return {row.sku: row for row in query.all()}
+    
+    def _velocity_from_stats(self, sku: str, days: int, warehouse: Optional[str], stats,
+                             full: bool = True) -> Dict:
+        """Velocity metrics from a _get_velocity_stats_sql row (None if no sales)"""
+        if stats is None:
+            return self._build_velocity(sku, days, warehouse, 0, 0, None, None, _NO_SALES, full=full)
+        return self._build_velocity(
+            sku, days, warehouse,
+            float(stats.total_quantity), int(stats.order_count),
+            stats.first_order, stats.last_order, _NO_SALES,
+            trend=float(stats.trend), variability=float(stats.variability), full=full
+        )
+    
+    def _get_daily_sales_bulk(self, start_date, end_date,
+                              skus: Optional[List[str]] = None) -> pd.DataFrame:
+        """Daily (sku, date) sales for many SKUs in one query (all SKUs if skus is None)"""
+        query = self.db.session.query(
+            OrderLine.sku,
+            Order.order_date,
+            func.sum(OrderLine.quantity).label('quantity'),
+            func.count(OrderLine.id).label('line_count')
+        ).join(
+            Order, OrderLine.order_id == Order.id
+        ).filter(
+            and_(
+                Order.order_date >= start_date,
+                Order.order_date <= end_date,
+                Order.status != 'VOIDED'
+            )
+        )
+        
+        if skus is not None:
+            query = query.filter(OrderLine.sku.in_(skus))
+        
+        query = query.group_by(OrderLine.sku, Order.order_date)
+        
+        # Stream rows in batches rather than materializing a Row list first
+        return pd.DataFrame.from_records(
+            iter(query.yield_per(STREAM_BATCH_SIZE)), columns=['sku', 'date', 'quantity', 'line_count']
+        )
+    
+    def _velocity_for_skus(self, skus: List[str], days: int, full: bool = True) -> List[Dict]:
+        """Velocity metrics for each SKU, querying only those not already cached"""
+        epoch = _cache_epoch
+        velocities = {}
+        for sku in skus:
+            cached = self._cache_get(('velocity', sku, days, None, full, epoch))
+            if cached is not None:
+                velocities[sku] = cached
+        
+        missing = [sku for sku in skus if sku not in velocities]
+        if missing:
+            for velocity in self._compute_velocity_for_skus(missing, days, full):
+                self._cache_put(('velocity', velocity['sku'], days, None, full, epoch), velocity)
+                velocities[velocity['sku']] = velocity
+        
+        return [velocities[sku] for sku in skus]
+    
+    def _compute_velocity_for_skus(self, skus: List[str], days: int,
+                                   full: bool = True) -> List[Dict]:
+        """Velocity metrics for each SKU from the daily matrix or a single grouped query"""
+        window = self._daily_matrix.window(skus, days)
+        if window is not None:
+            return self._velocity_from_window(skus, days, *window, full=full)
+        
+        start_date, end_date = _date_range(days)
+        
+        if self._use_sql_stats():
+            stats_by_sku = self._get_velocity_stats_sql(start_date, end_date, skus)
+            return [
+                self._velocity_from_stats(sku, days, None, stats_by_sku.get(sku), full)
+                for sku in skus
+            ]
+        
+        df = self._get_daily_sales_bulk(start_date, end_date, skus)
+        df['quantity'] = df['quantity'].fillna(0)
+        
+        # Zero-filled (n_skus, n_days) matrix over the whole window for the stats kernel
+        n_days = (end_date - start_date).days + 1
+        codes, sku_index = pd.factorize(df['sku'])
+        day_idx = (
+            pd.to_datetime(df['date']).to_numpy(dtype='datetime64[D]') - np.datetime64(start_date)
+        ).astype(np.int64)
+        daily = np.zeros((len(sku_index), n_days), dtype=np.float64)
+        daily[codes, day_idx] = df['quantity'].to_numpy(dtype=np.float64)
+        slopes, cvs = velocity_stats(daily) if full else (np.zeros(len(daily)), np.zeros(len(daily)))
+        
+        totals = df.groupby('sku').agg(
+            quantity=('quantity', 'sum'),
+            line_count=('line_count', 'sum'),
+            first_order=('date', 'min'),
+            last_order=('date', 'max')
+        )
+        totals = totals.join(pd.DataFrame({'trend': slopes, 'variability': cvs}, index=sku_index))
+        
         results = []
         for sku in skus:
-            velocity = self.calculate_velocity(sku, days)
-            results.append(velocity)
+            if sku not in totals.index:
+                results.append(self._build_velocity(
+                    sku, days, None, 0, 0, None, None, _NO_SALES, full=full
+                ))
+                continue
+            
+            row = totals.loc[sku]
+            results.append(self._build_velocity(
+                sku, days, None,
+                float(row['quantity']), int(row['line_count']),
+                row['first_order'], row['last_order'], _NO_SALES,
+                trend=float(row['trend']), variability=float(row['variability']), full=full
+            ))
+        
+        return results
+    
+    def _velocity_from_window(self, skus: List[str], days: int, start_date,
+                              quantities: np.ndarray, lines: np.ndarray,
+                              totals: np.ndarray, line_counts: np.ndarray,
+                              full: bool = True) -> List[Dict]:
+        """Velocity metrics from a DailySalesMatrix.window() slice"""
+        if full:
+            slopes, cvs = velocity_stats(quantities)
+        else:
+            slopes = cvs = np.zeros(len(skus))
+        
+        # First/last sale dates from the first/last day with any order lines
+        has_sales = lines > 0
+        any_sales = has_sales.any(axis=1)
+        first_idx = has_sales.argmax(axis=1)
+        last_idx = has_sales.shape[1] - 1 - has_sales[:, ::-1].argmax(axis=1)
+        
+        results = []
+        for i, sku in enumerate(skus):
+            if not any_sales[i]:
+                results.append(self._build_velocity(
+                    sku, days, None, 0, 0, None, None, _NO_SALES, full=full
+                ))
+                continue
+            
+            results.append(self._build_velocity(
+                sku, days, None,
+                float(totals[i]), int(line_counts[i]),
+                start_date + timedelta(days=int(first_idx[i])),
+                start_date + timedelta(days=int(last_idx[i])), _NO_SALES,
+                trend=float(slopes[i]), variability=float(cvs[i]), full=full
+            ))
+        
+        return results
+    
+    def calculate_velocity_bulk(self, skus: List[str], days: int = 30,
+                                warehouse: Optional[str] = None) -> List[Dict]:
+        """Calculate velocity for multiple SKUs"""
+        if warehouse:
+            # Warehouse-filtered velocity is per-SKU; overlap the queries instead
+            results = self._velocity_per_sku(skus, days, warehouse)
+        else:
+            try:
+                results = self._velocity_for_skus(skus, days)
+            except Exception as e:
+                logger.error(f"Failed to calculate bulk velocity: {e}")
+                results = self._velocity_per_sku(skus, days)
         
         # Sort by daily average (highest first)
         results.sort(key=lambda x: x.get('daily_average', 0), reverse=True)
         
         return results
     
+    def _velocity_per_sku(self, skus: List[str], days: int,
+                          warehouse: Optional[str] = None) -> List[Dict]:
+        """calculate_velocity for each SKU, run concurrently across the connection pool"""
+        workers = min(len(skus), self._pool_size())
+        if workers <= 1:
+            return [self.calculate_velocity(sku, days, warehouse) for sku in skus]
+        
+        # Each worker gets its own app context, and with it its own scoped session
+        app = current_app._get_current_object()
+        
+        def velocity_in_context(sku):
+            with app.app_context():
+                return self.calculate_velocity(sku, days, warehouse)
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(velocity_in_context, skus))
+    
+    def _pool_size(self) -> int:
+        """Connections the engine pool can hand out at once (1 if not a sized pool)"""
+        size = getattr(self.db.engine.pool, 'size', None)
+        return size() if callable(size) else 1
+    
     def get_top_movers(self, days: int = 30, limit: int = 20) -> List[Dict]:
         """Get top selling SKUs by velocity"""
+        top_skus = self._daily_matrix.ranked(days, limit)
+        if top_skus is not None:
+            return self._velocity_for_skus(top_skus, days)
+        
         # Get all SKUs with sales in the period
-        end_date = datetime.utcnow().date()
-        start_date = end_date - timedelta(days=days)
+        start_date, end_date = _date_range(days)
         
         query = self.db.session.query(
             OrderLine.sku,
@@ -226,26 +781,51 @@ class SalesVelocityCalculator:
             func.sum(OrderLine.quantity).desc()
         ).limit(limit)
         
-        results = []
-        for sku, total_quantity in query.all():
-            velocity = self.calculate_velocity(sku, days)
-            results.append(velocity)
+        top_skus = [sku for sku, total_quantity in query.all()]
         
-        return results
+        # Full metrics for the top SKUs in one grouped query, kept in ranking order
+        return self._velocity_for_skus(top_skus, days)
     
     def get_slow_movers(self, days: int = 90, threshold: float = 0.1) -> List[Dict]:
         """Get slow-moving SKUs (low velocity)"""
-        # Get all SKUs
         from database import Product
-        all_skus = self.db.session.query(Product.sku).all()
+        start_date, end_date = _date_range(days)
         
-        slow_movers = []
-        for (sku,) in all_skus:
-            velocity = self.calculate_velocity(sku, days)
-            
-            # Check if it's a slow mover
-            if velocity.get('daily_average', 0) < threshold:
-                slow_movers.append(velocity)
+        sales = self.db.session.query(
+            OrderLine.sku.label('sku'),
+            func.sum(OrderLine.quantity).label('total_quantity'),
+            func.min(Order.order_date).label('first_order'),
+            func.max(Order.order_date).label('last_order')
+        ).join(
+            Order, OrderLine.order_id == Order.id
+        ).filter(
+            and_(
+                Order.order_date >= start_date,
+                Order.order_date <= end_date,
+                Order.status != 'VOIDED'
+            )
+        ).group_by(OrderLine.sku).subquery()
+        
+        # One row per product, no sales as 0. daily_average >= total / days, so
+        # anything selling threshold * days or more can't be slow
+        query = self.db.session.query(
+            Product.sku,
+            func.coalesce(sales.c.total_quantity, 0),
+            sales.c.first_order,
+            sales.c.last_order
+        ).outerjoin(
+            sales, sales.c.sku == Product.sku
+        ).filter(
+            func.coalesce(sales.c.total_quantity, 0) < threshold * days
+        ).order_by(Product.id)
+        
+        # Exact velocity from the aggregate; details only for actual slow movers
+        slow_skus = [
+            sku for sku, total_quantity, first_order, last_order in query.yield_per(STREAM_BATCH_SIZE)
+            if _daily_average(total_quantity, first_order, last_order, days)[1] < threshold
+        ]
+        # Only ranked by daily_average, so trend/variability are skipped
+        slow_movers = self._velocity_for_skus(slow_skus, days, full=False)
         
         # Sort by velocity (lowest first)
         slow_movers.sort(key=lambda x: x.get('daily_average', 0))
@@ -254,63 +834,17 @@ class SalesVelocityCalculator:
     
     def calculate_seasonality(self, sku: str, months: int = 12) -> Dict:
         """Calculate seasonality patterns for a SKU"""
+        key = ('seasonality', sku, months, _cache_epoch)
+        seasonality = self._cache_get(key)
+        if seasonality is None:
+            seasonality = self._calculate_seasonality(sku, months)
+            self._cache_put(key, seasonality)
+        return seasonality
+    
+    def _calculate_seasonality(self, sku: str, months: int) -> Dict:
+        """Uncached calculate_seasonality"""
         try:
-            end_date = datetime.utcnow().date()
-            start_date = end_date - timedelta(days=months * 30)
-            
-            # Get monthly aggregates
-            query = self.db.session.query(
-                func.extract('month', Order.order_date).label('month'),
-                func.extract('year', Order.order_date).label('year'),
-                func.sum(OrderLine.quantity).label('quantity')
-            ).join(
-                Order, OrderLine.order_id == Order.id
-            ).filter(
-                and_(
-                    OrderLine.sku == sku,
-                    Order.order_date >= start_date,
-                    Order.order_date <= end_date,
-                    Order.status != 'VOIDED'
-                )
-            ).group_by(
-                func.extract('year', Order.order_date),
-                func.extract('month', Order.order_date)
-            )
-            
-            monthly_data = {}
-            for month, year, quantity in query.all():
-                month_key = f"{int(year)}-{int(month):02d}"
-                monthly_data[month_key] = quantity or 0
-            
-            # Calculate average by month
-            month_averages = {}
-            for month_num in range(1, 13):
-                month_quantities = [
-                    qty for key, qty in monthly_data.items() 
-                    if key.endswith(f"-{month_num:02d}")
-                ]
-                if month_quantities:
-                    month_averages[month_num] = np.mean(month_quantities)
-                else:
-                    month_averages[month_num] = 0
-            
-            # Calculate seasonality index (ratio to average)
-            overall_average = np.mean(list(month_averages.values()))
-            seasonality_index = {}
-            
-            if overall_average > 0:
-                for month, avg in month_averages.items():
-                    seasonality_index[month] = avg / overall_average
-            else:
-                seasonality_index = {m: 1.0 for m in range(1, 13)}
-            
-            return {
-                'sku': sku,
-                'monthly_averages': month_averages,
-                'seasonality_index': seasonality_index,
-                'peak_month': max(month_averages, key=month_averages.get) if month_averages else None,
-                'low_month': min(month_averages, key=month_averages.get) if month_averages else None
-            }
+            return self._seasonality_for_skus([sku], months)[0]
             
         except Exception as e:
             logger.error(f"Failed to calculate seasonality for {sku}: {e}")
@@ -318,3 +852,64 @@ class SalesVelocityCalculator:
                 'sku': sku,
                 'error': str(e)
             }
+    
+    def calculate_seasonality_bulk(self, skus: List[str], months: int = 12) -> List[Dict]:
+        """Calculate seasonality patterns for multiple SKUs from one query"""
+        try:
+            return self._seasonality_for_skus(skus, months)
+        except Exception as e:
+            logger.error(f"Failed to calculate bulk seasonality: {e}")
+            return [self.calculate_seasonality(sku, months) for sku in skus]
+    
+    def _seasonality_for_skus(self, skus: List[str], months: int) -> List[Dict]:
+        """Seasonality for each SKU, vectorized over a (n_skus, 12) month-average matrix"""
+        start_date, end_date = _date_range(months * 30)
+        
+        # Get monthly aggregates
+        query = self.db.session.query(
+            OrderLine.sku,
+            func.extract('month', Order.order_date).label('month'),
+            func.extract('year', Order.order_date).label('year'),
+            func.sum(OrderLine.quantity).label('quantity')
+        ).join(
+            Order, OrderLine.order_id == Order.id
+        ).filter(
+            and_(
+                OrderLine.sku.in_(skus),
+                Order.order_date >= start_date,
+                Order.order_date <= end_date,
+                Order.status != 'VOIDED'
+            )
+        ).group_by(
+            OrderLine.sku,
+            func.extract('year', Order.order_date),
+            func.extract('month', Order.order_date)
+        )
+        
+        df = pd.DataFrame(query.all(), columns=['sku', 'month', 'year', 'quantity'])
+        df['quantity'] = df['quantity'].fillna(0)
+        
+        # Average by calendar month across years, one row per SKU
+        month_averages = df.groupby(['sku', df['month'].astype(int)])['quantity'].mean().unstack()
+        month_averages = month_averages.reindex(
+            index=skus, columns=range(1, 13), fill_value=0
+        ).fillna(0).to_numpy(dtype=np.float64)
+        
+        # Seasonality index (ratio to average); flat 1.0 for SKUs without sales
+        overall_average = month_averages.mean(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            seasonality_index = np.where(overall_average > 0, month_averages / overall_average, 1.0)
+        peak_months = month_averages.argmax(axis=1) + 1
+        low_months = month_averages.argmin(axis=1) + 1
+        
+        month_numbers = range(1, 13)
+        return [
+            {
+                'sku': sku,
+                'monthly_averages': dict(zip(month_numbers, month_averages[i].tolist())),
+                'seasonality_index': dict(zip(month_numbers, seasonality_index[i].tolist())),
+                'peak_month': int(peak_months[i]),
+                'low_month': int(low_months[i])
+            }
+            for i, sku in enumerate(skus)
+        ]
@@ -7,8 +7,11 @@ Helps configure automatic hourly sync on different platforms
 import os
 import sys
 import subprocess
+from functools import lru_cache
+from importlib.metadata import distribution, PackageNotFoundError
 from pathlib import Path
 
+@lru_cache(maxsize=1)
 def get_app_path():
     """Get the full path to the application directory"""
     return os.path.abspath(os.path.dirname(__file__))
@@ -154,24 +157,26 @@ def check_dependencies():
     """Check if all dependencies are available"""
     print("🔍 Checking Dependencies...")
     
-    # Check Python modules
+    # Check Python packages via their installed metadata (no module imports)
     required_modules = ['requests', 'flask', 'python-dotenv', 'pytz']
     missing_modules = []
     
     for module in required_modules:
         try:
-            __import__(module.replace('-', '_'))
+            distribution(module)
             print(f"✅ {module}")
-        except ImportError:
+        except PackageNotFoundError:
             print(f"❌ {module} - MISSING")
             missing_modules.append(module)
     
-    # Check files
+    # Check files against one listing of the working directory
     required_files = ['unified_stock_app.py', 'database_migrations.sql', '.env']
     missing_files = []
+    with os.scandir('.') as entries:
+        present_files = {entry.name for entry in entries}
     
     for file in required_files:
-        if os.path.exists(file):
+        if file in present_files:
             print(f"✅ {file}")
         else:
             print(f"❌ {file} - MISSING")
@@ -11,6 +11,18 @@ import sqlite3
 import requests
 import json
 import logging
+import numpy as np
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from rate_limit import TokenBucket, SQLITE_IN_CHUNK, RETRY_STATUSES, get_with_retries
+from json_provider import OrjsonProvider
+
+try:
+    from numba import njit
+except ImportError:  # Optional; reorder math falls back to NumPy
+    njit = None
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -20,14 +32,80 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+def _reorder_math_numpy(total_qty, current_stock, lead_time_days, review_days, safety_factor):
+    """
+    Reorder math for every SKU from its 30-day quantity sold
+    
+    Returns (daily_velocity, safety_stock, reorder_point, days_until_stockout)
+    arrays, unrounded; days_until_stockout is 999 for SKUs with no sales.
+    """
+    daily_velocity = total_qty / 30
+    
+    # Formula: (Lead Time + Review Period) × Daily Velocity + Safety Stock
+    demand_during_lead_time = (lead_time_days + review_days) * daily_velocity
+    safety_stock = safety_factor * daily_velocity * np.sqrt(lead_time_days)
+    reorder_point = demand_during_lead_time + safety_stock
+    
+    days_until_stockout = np.divide(current_stock, daily_velocity,
+                                    out=np.full(len(total_qty), 999.0), where=daily_velocity > 0)
+    
+    return daily_velocity, safety_stock, reorder_point, days_until_stockout
+
+if njit is not None:
+    # cache=True keeps the compiled kernel on disk, so only the first request
+    # after a deploy pays the JIT compile
+    @njit(cache=True)
+    def _reorder_math_numba(total_qty, current_stock, lead_time_days, review_days, safety_factor):
+        """Numba version of _reorder_math_numpy: one fused pass over the SKUs"""
+        n = total_qty.shape[0]
+        daily_velocity = np.empty(n)
+        safety_stock = np.empty(n)
+        reorder_point = np.empty(n)
+        days_until_stockout = np.empty(n)
+        sqrt_lead = lead_time_days ** 0.5
+        for i in range(n):
+            v = total_qty[i] / 30
+            daily_velocity[i] = v
+            safety_stock[i] = safety_factor * v * sqrt_lead
+            reorder_point[i] = (lead_time_days + review_days) * v + safety_stock[i]
+            days_until_stockout[i] = current_stock / v if v > 0 else 999.0
+        return daily_velocity, safety_stock, reorder_point, days_until_stockout
+    
+    reorder_math = _reorder_math_numba
+else:
+    reorder_math = _reorder_math_numpy
+
 # Database setup
 DATABASE = 'stock_forecast.db'
 
+# Applied to every connection (journal_mode=WAL also persists in the file)
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+)
+
+# Bump to rebuild daily_sku_totals and its triggers on the next init_db()
+DAILY_TOTALS_VERSION = 2
+
+def _connect(**kwargs):
+    """Open a tuned SQLite connection"""
+    conn = sqlite3.connect(DATABASE, **kwargs)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _day_number(days_ago=0):
+    """UTC day number (days since 1970-01-01) `days_ago` days back, as in daily_sku_totals.sale_day"""
+    return int(time.time() // 86400) - days_ago
+
 def init_db():
     """Initialize SQLite database with simple schema"""
-    conn = sqlite3.connect(DATABASE)
+    conn = _connect()
     cursor = conn.cursor()
     
     # Simple tables for MVP
@@ -63,15 +141,161 @@ def init_db():
         )
     ''')
     
+    # Versions of derived schema objects, so upgrades don't depend on guessing from table contents
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_versions (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+    
+    # Daily per-SKU rollup of sales, kept current by triggers on insert, delete
+    # and update. The analytical routes read this instead of re-aggregating raw
+    # sales lines. sale_day is the integer day number (days since 1970-01-01),
+    # so window filters are integer comparisons rather than date-string parsing.
+    # Built in one write transaction: a sync can't insert between the triggers
+    # going live and the backfill, and a failed build leaves no version marker
+    cursor.execute('BEGIN IMMEDIATE')
+    cursor.execute("SELECT version FROM schema_versions WHERE component = 'daily_sku_totals'")
+    row = cursor.fetchone()
+    if row is None or row[0] < DAILY_TOTALS_VERSION:
+        # Derived data: rebuild it from sales rather than migrating it
+        cursor.execute('DROP TRIGGER IF EXISTS trg_sales_daily_totals')
+        cursor.execute('DROP TRIGGER IF EXISTS trg_sales_daily_totals_delete')
+        cursor.execute('DROP TRIGGER IF EXISTS trg_sales_daily_totals_update')
+        cursor.execute('DROP TABLE IF EXISTS daily_sku_totals')
+        
+        cursor.execute('''
+            CREATE TABLE daily_sku_totals (
+                sku TEXT NOT NULL,
+                sale_day INTEGER NOT NULL,
+                quantity REAL NOT NULL,
+                sale_count INTEGER NOT NULL,
+                PRIMARY KEY (sku, sale_day)
+            )
+        ''')
+        # Date-window scans across all SKUs (reorder analysis, stock status)
+        cursor.execute('CREATE INDEX idx_daily_sku_totals_day ON daily_sku_totals(sale_day)')
+        
+        # Lines without a parseable date never matched a date window; skip them
+        # (their sale_day is NULL, which no rollup row matches)
+        cursor.execute('''
+            CREATE TRIGGER trg_sales_daily_totals AFTER INSERT ON sales
+            WHEN julianday(NEW.sale_date) IS NOT NULL
+            BEGIN
+                INSERT INTO daily_sku_totals (sku, sale_day, quantity, sale_count)
+                VALUES (NEW.sku, CAST(julianday(NEW.sale_date) - 2440587.5 AS INTEGER), NEW.quantity, 1)
+                ON CONFLICT(sku, sale_day) DO UPDATE SET
+                    quantity = quantity + excluded.quantity,
+                    sale_count = sale_count + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER trg_sales_daily_totals_delete AFTER DELETE ON sales
+            WHEN julianday(OLD.sale_date) IS NOT NULL
+            BEGIN
+                UPDATE daily_sku_totals
+                SET quantity = quantity - OLD.quantity, sale_count = sale_count - 1
+                WHERE sku = OLD.sku AND sale_day = CAST(julianday(OLD.sale_date) - 2440587.5 AS INTEGER);
+                DELETE FROM daily_sku_totals
+                WHERE sku = OLD.sku AND sale_day = CAST(julianday(OLD.sale_date) - 2440587.5 AS INTEGER)
+                AND sale_count <= 0;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER trg_sales_daily_totals_update AFTER UPDATE OF sku, quantity, sale_date ON sales
+            BEGIN
+                UPDATE daily_sku_totals
+                SET quantity = quantity - OLD.quantity, sale_count = sale_count - 1
+                WHERE sku = OLD.sku AND sale_day = CAST(julianday(OLD.sale_date) - 2440587.5 AS INTEGER);
+                DELETE FROM daily_sku_totals
+                WHERE sku = OLD.sku AND sale_day = CAST(julianday(OLD.sale_date) - 2440587.5 AS INTEGER)
+                AND sale_count <= 0;
+                INSERT INTO daily_sku_totals (sku, sale_day, quantity, sale_count)
+                SELECT NEW.sku, CAST(julianday(NEW.sale_date) - 2440587.5 AS INTEGER), NEW.quantity, 1
+                WHERE julianday(NEW.sale_date) IS NOT NULL
+                ON CONFLICT(sku, sale_day) DO UPDATE SET
+                    quantity = quantity + excluded.quantity,
+                    sale_count = sale_count + 1;
+            END
+        ''')
+        
+        # Backfill every sale stored before these triggers existed
+        cursor.execute('''
+            INSERT INTO daily_sku_totals (sku, sale_day, quantity, sale_count)
+            SELECT sku, CAST(julianday(sale_date) - 2440587.5 AS INTEGER), SUM(quantity), COUNT(*)
+            FROM sales
+            WHERE julianday(sale_date) IS NOT NULL
+            GROUP BY 1, 2
+        ''')
+        cursor.execute('''
+            INSERT INTO schema_versions (component, version) VALUES ('daily_sku_totals', ?)
+            ON CONFLICT(component) DO UPDATE SET version = excluded.version
+        ''', (DAILY_TOTALS_VERSION,))
+    
     conn.commit()
     conn.close()
 
+# One connection per worker thread, reused for the life of the process
+_local = threading.local()
+
+# Long-lived connections re-run PRAGMA optimize this often so the planner's
+# stats follow the data (it is a no-op unless a table changed enough)
+OPTIMIZE_INTERVAL = 15 * 60
+
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    """Get this thread's database connection (autocommit; BEGIN explicitly to write)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect(isolation_level=None)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        _local.conn = conn
+        _local.optimize_due = time.monotonic() + OPTIMIZE_INTERVAL
+    elif time.monotonic() >= _local.optimize_due:
+        conn.execute('PRAGMA optimize')
+        _local.optimize_due = time.monotonic() + OPTIMIZE_INTERVAL
     return conn
 
+@app.teardown_appcontext
+def _end_transaction(exc):
+    """Never hand a reused connection to the next request mid-transaction"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Response bodies of the read-only analytical routes, reused until they expire
+# or a sync stores new sales
+STATUS_CACHE_TTL = 30
+REORDER_CACHE_TTL = 300
+_response_cache = {}
+_cache_generation = 0
+_cache_lock = threading.Lock()
+
+def _cached(key, ttl, compute):
+    """Return the cached value for key, computing and storing it if missing or expired"""
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _response_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        generation = _cache_generation
+    
+    value = compute()
+    
+    with _cache_lock:
+        # Don't store a result computed from data a sync has since replaced
+        if generation == _cache_generation:
+            _response_cache[key] = (now + ttl, value)
+    return value
+
+def invalidate_response_cache():
+    """Drop all cached responses (call after new sales are stored)"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _response_cache.clear()
+
 class SimpleCin7Client:
     """Simplified Cin7 client for testing"""
     
@@ -82,23 +306,34 @@ class SimpleCin7Client:
         
         if not self.account_id or not self.api_key:
             raise ValueError("Missing CIN7_ACCOUNT_ID or CIN7_API_KEY in environment")
-    
-    def _make_request(self, endpoint, params=None):
-        """Make API request to Cin7"""
-        headers = {
+        
+        # One keep-alive session shared by all worker threads
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=8, max_retries=0))
+        self.session.headers.update({
             'api-auth-accountid': self.account_id,
             'api-auth-applicationkey': self.api_key,
             'Content-Type': 'application/json'
-        }
+        })
+        
+        # Shared request budget: 50 calls/minute sustained, plus a burst of 5
+        # banked while idle, so at most 55 in any minute (Cin7 allows 60).
+        # Small syncs go out immediately; the bucket, not the worker count,
+        # sets the call rate once the burst is spent
+        self._bucket = TokenBucket(1.2, capacity=5)
+        self.max_workers = 4
+        self.max_retries = 6
+    
+    def _make_request(self, endpoint, params=None):
+        """Make API request to Cin7, retrying 429/5xx and connection errors with bounded backoff"""
+        self._bucket.acquire()
         
-        url = f"{self.base_url}{endpoint}"
-        response = requests.get(url, headers=headers, params=params, timeout=30)
+        url = self.base_url + endpoint
         
-        if response.status_code == 429:
-            logger.warning("Rate limited - waiting...")
-            import time
-            time.sleep(5)
-            return self._make_request(endpoint, params)
+        response = get_with_retries(self.session, url, params=params, timeout=30,
+                                    max_retries=self.max_retries, max_wait=30)
+        if response.status_code in RETRY_STATUSES:
+            raise RuntimeError(f"{endpoint} still failing after {self.max_retries} attempts (HTTP {response.status_code})")
         
         response.raise_for_status()
         return response.json()
@@ -111,43 +346,48 @@ class SimpleCin7Client:
         except Exception as e:
             return False, str(e)
     
+    def _fetch_sale_page(self, from_date, page):
+        """One page of the SaleList since from_date"""
+        params = {
+            'Page': page,
+            'Limit': 100,
+            'OrderDateFrom': from_date
+        }
+        return self._make_request('/SaleList', params).get('SaleList', [])
+    
     def fetch_recent_orders(self, days=30):
         """Fetch recent orders for velocity calculation"""
         from_date = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+        max_pages = 5  # Limit to 5 pages for MVP
         
         try:
-            orders = []
-            page = 1
+            # Page 1 alone tells us whether there is more than one page; only
+            # then are the remaining pages requested, concurrently
+            pages = [self._fetch_sale_page(from_date, 1)]
+            if len(pages[0]) == 100:
+                with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                    pages.extend(pool.map(lambda page: self._fetch_sale_page(from_date, page),
+                                          range(2, max_pages + 1)))
             
-            while page <= 5:  # Limit to 5 pages for MVP
-                params = {
-                    'Page': page,
-                    'Limit': 100,
-                    'OrderDateFrom': from_date
-                }
-                
-                result = self._make_request('/SaleList', params)
-                sale_list = result.get('SaleList', [])
-                
+            orders = []
+            for sale_list in pages:
                 if not sale_list:
                     break
                 
                 # Filter valid orders and extract basic data
-                for sale in sale_list:
-                    if sale.get('Status') != 'VOIDED':  # Skip cancelled
-                        orders.append({
-                            'sale_id': sale.get('SaleID'),
-                            'order_number': sale.get('OrderNumber'),
-                            'order_date': sale.get('OrderDate', '').split('T')[0],
-                            'warehouse': self._map_location(sale.get('OrderLocationID'))
-                        })
+                orders.extend([
+                    {
+                        'sale_id': sale.get('SaleID'),
+                        'order_number': sale.get('OrderNumber'),
+                        'order_date': sale.get('OrderDate', '')[:10],
+                        'warehouse': self._map_location(sale.get('OrderLocationID'))
+                    }
+                    for sale in sale_list
+                    if sale.get('Status') != 'VOIDED'  # Skip cancelled
+                ])
                 
                 if len(sale_list) < 100:
                     break
-                
-                page += 1
-                import time
-                time.sleep(1)  # Rate limiting
             
             return orders
             
@@ -176,6 +416,11 @@ class SimpleCin7Client:
             logger.error(f"Failed to fetch order lines for {sale_id}: {e}")
             return []
     
+    def fetch_order_lines_bulk(self, sale_ids):
+        """Fetch order lines for many sales concurrently, returns {sale_id: lines}"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(sale_ids, pool.map(self.fetch_order_lines, sale_ids)))
+    
     def _map_location(self, location_id):
         """Simple location mapping - enhance later"""
         # For MVP, return a default
@@ -206,44 +451,72 @@ def sync_sales():
         # Fetch recent orders
         orders = cin7.fetch_recent_orders(days=60)  # Get 60 days of data
         
+        # Get the detailed lines for each order, fetched concurrently under the
+        # client's rate limiter. Done before opening the write transaction so
+        # the lock is never held across HTTP calls
+        batch = orders[:10]  # Limit to 10 orders for testing
+        logger.info(f"Fetching lines for {len(batch)} orders")
+        lines_by_sale = cin7.fetch_order_lines_bulk([order['sale_id'] for order in batch])
+        fetched = [(order, lines_by_sale[order['sale_id']]) for order in batch]
+        
         conn = get_db()
         cursor = conn.cursor()
         
-        total_lines = 0
-        
-        # For each order, get the detailed lines
-        for i, order in enumerate(orders[:10]):  # Limit to 10 orders for testing
-            logger.info(f"Processing order {i+1}/{min(10, len(orders))}: {order['order_number']}")
-            
-            lines = cin7.fetch_order_lines(order['sale_id'])
-            
+        # Collect rows up front so each statement is prepared once. One
+        # description per SKU: the last non-empty one seen
+        descriptions = {}
+        sales_rows = []
+        for order, lines in fetched:
             for line in lines:
                 if line['sku'] and line['quantity'] > 0:
-                    # Store product if not exists
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO products (sku, description)
-                        VALUES (?, ?)
-                    ''', (line['sku'], line['description']))
-                    
-                    # Store sale
-                    cursor.execute('''
-                        INSERT INTO sales (sku, quantity, sale_date, warehouse, order_number)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (
+                    if line['description'] or line['sku'] not in descriptions:
+                        descriptions[line['sku']] = line['description']
+                    sales_rows.append((
                         line['sku'],
                         line['quantity'],
                         order['order_date'],
                         order['warehouse'],
                         order['order_number']
                     ))
-                    
-                    total_lines += 1
+        
+        total_lines = len(sales_rows)
+        
+        try:
+            # One transaction (one fsync) for the whole sync
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Only write SKUs that are new or whose description changed in Cin7;
+            # known, unchanged products skip the INSERT entirely
+            known = dict(cursor.execute('SELECT sku, description FROM products'))
+            product_rows = [
+                (sku, description) for sku, description in descriptions.items()
+                if sku not in known or (description and description != known[sku])
+            ]
+            
+            # Store new products; refresh descriptions changed in Cin7
+            cursor.executemany('''
+                INSERT INTO products (sku, description)
+                VALUES (?, ?)
+                ON CONFLICT(sku) DO UPDATE SET description = excluded.description
+                WHERE excluded.description != '' AND products.description IS NOT excluded.description
+            ''', product_rows)
+            
+            # Store sales
+            cursor.executemany('''
+                INSERT INTO sales (sku, quantity, sale_date, warehouse, order_number)
+                VALUES (?, ?, ?, ?, ?)
+            ''', sales_rows)
             
             conn.commit()
-            import time
-            time.sleep(2)  # Rate limiting
+        except Exception:
+            conn.rollback()
+            raise
+        
+        # A sync is the big write burst; refresh planner stats while it's fresh
+        cursor.execute('PRAGMA optimize')
         
-        conn.close()
+        if sales_rows:
+            invalidate_response_cache()
         
         return jsonify({
             'success': True,
@@ -257,65 +530,184 @@ def sync_sales():
         logger.error(f"Sync failed: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _velocity_rows(cursor, days, skus=None):
+    """Sales totals and description per SKU over the last `days` days (all SKUs if skus is None)"""
+    sql = '''
+        SELECT 
+            s.sku,
+            SUM(s.quantity) as total_quantity,
+            SUM(s.sale_count) as sale_count,
+            date(MIN(s.sale_day) * 86400, 'unixepoch') as first_sale,
+            date(MAX(s.sale_day) * 86400, 'unixepoch') as last_sale,
+            p.description
+        FROM daily_sku_totals s
+        LEFT JOIN products p ON p.sku = s.sku
+        WHERE s.sale_day >= ?
+    '''
+    since_day = _day_number(days)
+    
+    if skus is None:
+        cursor.execute(sql + ' GROUP BY s.sku', (since_day,))
+        return cursor.fetchall()
+    
+    rows = []
+    for start in range(0, len(skus), SQLITE_IN_CHUNK):
+        chunk = skus[start:start + SQLITE_IN_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(sql + f' AND s.sku IN ({placeholders}) GROUP BY s.sku', (since_day, *chunk))
+        rows.extend(cursor.fetchall())
+    return rows
+
+def _velocity_results(rows, days):
+    """Velocity response entries for grouped sales rows, computed over all rows at once"""
+    rows = [row for row in rows if row['total_quantity']]
+    daily_velocity = np.array([row['total_quantity'] for row in rows], dtype=np.float64) / days
+    
+    columns = zip(
+        rows,
+        np.round(daily_velocity, 2).tolist(),
+        np.round(daily_velocity * 7, 2).tolist(),
+        np.round(daily_velocity * 30, 2).tolist()
+    )
+    return {
+        row['sku']: {
+            'sku': row['sku'],
+            'description': row['description'] or '',
+            'period_days': days,
+            'total_quantity_sold': row['total_quantity'],
+            'daily_velocity': daily,
+            'weekly_velocity': weekly,
+            'monthly_velocity': monthly,
+            'first_sale': row['first_sale'],
+            'last_sale': row['last_sale']
+        }
+        for row, daily, weekly, monthly in columns
+    }
+
+def _no_sales(sku):
+    """Velocity response for a SKU with no sales in the period"""
+    return {
+        'sku': sku,
+        'daily_velocity': 0,
+        'weekly_velocity': 0,
+        'monthly_velocity': 0,
+        'message': 'No sales data found'
+    }
+
 @app.route('/velocity/<sku>')
 def calculate_velocity(sku):
     """Calculate sales velocity for a SKU"""
     try:
         days = int(request.args.get('days', 30))
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get sales data for the SKU
-        cursor.execute('''
-            SELECT 
-                SUM(quantity) as total_quantity,
-                COUNT(*) as sale_count,
-                MIN(sale_date) as first_sale,
-                MAX(sale_date) as last_sale
-            FROM sales 
-            WHERE sku = ? 
-            AND sale_date >= date('now', '-{} days')
-        '''.format(days), (sku,))
-        
-        result = cursor.fetchone()
-        
-        if not result or not result['total_quantity']:
-            return jsonify({
-                'sku': sku,
-                'daily_velocity': 0,
-                'weekly_velocity': 0,
-                'monthly_velocity': 0,
-                'message': 'No sales data found'
-            })
+        results = _velocity_results(_velocity_rows(get_db().cursor(), days, [sku]), days)
+        return jsonify(results.get(sku) or _no_sales(sku))
         
-        total_qty = result['total_quantity']
-        actual_days = days
-        
-        # Calculate velocity
-        daily_velocity = total_qty / actual_days
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/velocity-bulk')
+def velocity_bulk():
+    """Calculate sales velocity for many SKUs in one query (?skus=a,b,c, or every SKU sold)"""
+    try:
+        days = int(request.args.get('days', 30))
+        skus_param = request.args.get('skus')
+        skus = [sku for sku in skus_param.split(',') if sku] if skus_param else None
         
-        # Get product info
-        cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
-        product = cursor.fetchone()
+        results = _velocity_results(_velocity_rows(get_db().cursor(), days, skus), days)
         
-        conn.close()
+        if skus is None:
+            data = list(results.values())
+        else:
+            data = [results.get(sku) or _no_sales(sku) for sku in dict.fromkeys(skus)]
         
         return jsonify({
-            'sku': sku,
-            'description': product['description'] if product else '',
+            'success': True,
             'period_days': days,
-            'total_quantity_sold': total_qty,
-            'daily_velocity': round(daily_velocity, 2),
-            'weekly_velocity': round(daily_velocity * 7, 2),
-            'monthly_velocity': round(daily_velocity * 30, 2),
-            'first_sale': result['first_sale'],
-            'last_sale': result['last_sale']
+            'total_skus': len(data),
+            'data': data
         })
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _reorder_payload(lead_time_days, service_level, review_days):
+    """Reorder analysis response body for all SKUs"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Get current stock (mock data for now - would come from Cin7 stock API)
+    current_stock = 100  # Placeholder - replace with actual stock lookup
+    
+    # 30-day quantity and description for every SKU sold in the last 90 days,
+    # in one grouped pass instead of two queries per SKU, already sorted by
+    # urgency (lowest days until stockout first)
+    cursor.execute('''
+        SELECT 
+            s.sku,
+            SUM(CASE WHEN s.sale_day >= ? THEN s.quantity ELSE 0 END) as total_qty,
+            p.description
+        FROM daily_sku_totals s
+        LEFT JOIN products p ON p.sku = s.sku
+        WHERE s.sale_day >= ?
+        GROUP BY s.sku
+        ORDER BY CASE WHEN total_qty > 0 THEN ? * 30.0 / total_qty ELSE 999 END, s.sku
+    ''', (_day_number(30), _day_number(90), current_stock))
+    
+    rows = cursor.fetchall()
+    
+    # Whole-array reorder math over all SKUs at once
+    total_qty = np.array([row['total_qty'] or 0 for row in rows], dtype=np.float64)
+    
+    # Simple safety stock calculation (can be enhanced)
+    # For 95% service level, use ~1.65 standard deviations
+    safety_factor = 1.65 if service_level >= 95 else 1.28
+    
+    daily_velocity, safety_stock, reorder_point, days_until_stockout = reorder_math(
+        total_qty, float(current_stock), float(lead_time_days), float(review_days), safety_factor
+    )
+    
+    # Recommended order quantity (simple EOQ approximation)
+    # Order for lead time + review period + safety stock
+    recommended_qty = np.maximum(0, reorder_point - current_stock)
+    needs_reorder = current_stock < reorder_point
+    
+    columns = zip(
+        rows,
+        np.round(daily_velocity, 2).tolist(),
+        np.round(reorder_point).tolist(),
+        np.round(safety_stock).tolist(),
+        np.round(recommended_qty).tolist(),
+        needs_reorder.tolist(),
+        np.round(days_until_stockout).tolist()
+    )
+    reorder_data = [
+        {
+            'sku': row['sku'],
+            'description': row['description'] or '',
+            'current_stock': current_stock,
+            'daily_velocity': velocity,
+            'reorder_point': point,
+            'safety_stock': safety,
+            'recommended_order_qty': qty,
+            'needs_reorder': flag,
+            'days_until_stockout': days
+        }
+        for row, velocity, point, safety, qty, flag, days in columns
+    ]
+    
+    return {
+        'success': True,
+        'parameters': {
+            'lead_time_days': lead_time_days,
+            'service_level': service_level,
+            'review_days': review_days
+        },
+        'total_skus': len(reorder_data),
+        'needs_reorder': int(needs_reorder.sum()),
+        'data': reorder_data
+    }
+
 @app.route('/reorder-analysis')
 def reorder_analysis():
     """Calculate reorder points for all SKUs"""
@@ -325,113 +717,42 @@ def reorder_analysis():
         service_level = float(request.args.get('service_level', 95))  # 95% service level
         review_days = int(request.args.get('review_days', 7))  # Weekly review
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get all SKUs with sales
-        cursor.execute('''
-            SELECT DISTINCT sku 
-            FROM sales 
-            WHERE sale_date >= date('now', '-90 days')
-        ''')
-        
-        skus = [row['sku'] for row in cursor.fetchall()]
-        
-        reorder_data = []
-        
-        for sku in skus:
-            # Calculate 30-day velocity
-            cursor.execute('''
-                SELECT SUM(quantity) as total_qty
-                FROM sales 
-                WHERE sku = ? 
-                AND sale_date >= date('now', '-30 days')
-            ''', (sku,))
-            
-            result = cursor.fetchone()
-            total_qty = result['total_qty'] or 0
-            daily_velocity = total_qty / 30
-            
-            # Get current stock (mock data for now - would come from Cin7 stock API)
-            current_stock = 100  # Placeholder - replace with actual stock lookup
-            
-            # Calculate reorder point
-            # Formula: (Lead Time + Review Period) × Daily Velocity + Safety Stock
-            demand_during_lead_time = (lead_time_days + review_days) * daily_velocity
-            
-            # Simple safety stock calculation (can be enhanced)
-            # For 95% service level, use ~1.65 standard deviations
-            safety_factor = 1.65 if service_level >= 95 else 1.28
-            safety_stock = safety_factor * daily_velocity * (lead_time_days ** 0.5)
-            
-            reorder_point = demand_during_lead_time + safety_stock
-            
-            # Recommended order quantity (simple EOQ approximation)
-            # Order for lead time + review period + safety stock
-            recommended_qty = max(0, reorder_point - current_stock)
-            
-            # Get product description
-            cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
-            product = cursor.fetchone()
-            
-            reorder_data.append({
-                'sku': sku,
-                'description': product['description'] if product else '',
-                'current_stock': current_stock,
-                'daily_velocity': round(daily_velocity, 2),
-                'reorder_point': round(reorder_point, 0),
-                'safety_stock': round(safety_stock, 0),
-                'recommended_order_qty': round(recommended_qty, 0),
-                'needs_reorder': current_stock < reorder_point,
-                'days_until_stockout': round(current_stock / daily_velocity, 0) if daily_velocity > 0 else 999
-            })
-        
-        # Sort by urgency (lowest days until stockout first)
-        reorder_data.sort(key=lambda x: x['days_until_stockout'])
-        
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'parameters': {
-                'lead_time_days': lead_time_days,
-                'service_level': service_level,
-                'review_days': review_days
-            },
-            'total_skus': len(reorder_data),
-            'needs_reorder': len([x for x in reorder_data if x['needs_reorder']]),
-            'data': reorder_data
-        })
+        return jsonify(_cached(
+            ('reorder', lead_time_days, service_level, review_days), REORDER_CACHE_TTL,
+            lambda: _reorder_payload(lead_time_days, service_level, review_days)
+        ))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _stock_status_payload():
+    """Stock status overview response body"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Get basic stats
+    cursor.execute('SELECT COUNT(DISTINCT sku) FROM products')
+    total_skus = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT COUNT(DISTINCT sku) FROM daily_sku_totals WHERE sale_day >= ?', (_day_number(30),))
+    active_skus = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT COALESCE(SUM(sale_count), 0) FROM daily_sku_totals WHERE sale_day >= ?', (_day_number(7),))
+    recent_sales = cursor.fetchone()[0]
+    
+    return {
+        'total_skus': total_skus,
+        'active_skus_30d': active_skus,
+        'sales_last_7d': recent_sales,
+        'database_status': 'connected',
+        'last_updated': datetime.now().isoformat()
+    }
+
 @app.route('/stock-status')
 def stock_status():
     """Quick overview of stock status"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get basic stats
-        cursor.execute('SELECT COUNT(DISTINCT sku) FROM products')
-        total_skus = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(DISTINCT sku) FROM sales WHERE sale_date >= date("now", "-30 days")')
-        active_skus = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM sales WHERE sale_date >= date("now", "-7 days")')
-        recent_sales = cursor.fetchone()[0]
-        
-        conn.close()
-        
-        return jsonify({
-            'total_skus': total_skus,
-            'active_skus_30d': active_skus,
-            'sales_last_7d': recent_sales,
-            'database_status': 'connected',
-            'last_updated': datetime.now().isoformat()
-        })
+        return jsonify(_cached(('stock_status',), STATUS_CACHE_TTL, _stock_status_payload))
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
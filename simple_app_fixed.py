@@ -8,9 +8,15 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import orjson
 import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from rate_limit import TokenBucket, get_with_retries
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -25,9 +31,29 @@ CORS(app)
 # Database setup
 DATABASE = 'stock_forecast.db'
 
+# Cin7 responses retried by _make_request: rate limited or temporarily unavailable
+_RETRY_STATUSES = frozenset({429, 503})
+
+# Applied to every connection (journal_mode=WAL also persists in the file):
+# readers no longer block on a sync's writes, and commits skip an fsync
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA mmap_size=268435456',
+)
+
+def _connect():
+    """Open a tuned SQLite connection"""
+    conn = sqlite3.connect(DATABASE)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
 def init_db():
     """Initialize SQLite database with simple schema"""
-    conn = sqlite3.connect(DATABASE)
+    conn = _connect()
     cursor = conn.cursor()
     
     # Simple tables for MVP
@@ -63,15 +89,44 @@ def init_db():
         )
     ''')
     
+    # Per-SKU date-range lookups (velocity)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_sku_date ON sales(sku, sale_date)')
+    # Date-window scans across all SKUs (stock status)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(sale_date)')
+    
+    # Refresh planner statistics so the indexes above get used
+    cursor.execute('ANALYZE')
+    
     conn.commit()
     conn.close()
 
+# One connection per worker thread, reused for the life of the process
+_local = threading.local()
+
+# Long-lived connections re-run PRAGMA optimize this often so the planner's
+# stats follow the data (it is a no-op unless a table changed enough)
+OPTIMIZE_INTERVAL = 15 * 60
+
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    """Get this thread's database connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        _local.conn = conn
+        _local.optimize_due = time.monotonic() + OPTIMIZE_INTERVAL
+    elif time.monotonic() >= _local.optimize_due:
+        conn.execute('PRAGMA optimize')
+        _local.optimize_due = time.monotonic() + OPTIMIZE_INTERVAL
     return conn
 
+@app.teardown_appcontext
+def _end_transaction(exc):
+    """Never hand a reused connection to the next request mid-transaction"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
 class SimpleCin7Client:
     """Simplified Cin7 client with better error handling"""
     
@@ -83,47 +138,42 @@ class SimpleCin7Client:
         if not self.account_id or not self.api_key:
             raise ValueError("Missing CIN7_ACCOUNT_ID or CIN7_API_KEY in environment")
         
-        # Rate limiting
-        self.last_request_time = 0
-        self.min_request_interval = 1.0  # Minimum 1 second between requests
-    
-    def _wait_for_rate_limit(self):
-        """Ensure we don't exceed rate limits"""
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.min_request_interval:
-            sleep_time = self.min_request_interval - elapsed
-            logger.info(f"Rate limiting: waiting {sleep_time:.1f}s")
-            time.sleep(sleep_time)
-    
-    def _make_request(self, endpoint, params=None, timeout=15):
-        """Make API request to Cin7 with proper rate limiting"""
-        self._wait_for_rate_limit()
-        
-        headers = {
+        # One keep-alive session: the TCP/TLS handshake happens once, not per call
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+        self.session.headers.update({
             'api-auth-accountid': self.account_id,
             'api-auth-applicationkey': self.api_key,
             'Content-Type': 'application/json'
-        }
+        })
         
-        url = f"{self.base_url}{endpoint}"
+        # Same budget as simple_app: one call per 1.2s sustained plus a burst
+        # of 5 banked while idle, so never more than 55 in a minute (Cin7 allows 60)
+        self._bucket = TokenBucket(1.2, capacity=5)
+        self.max_retries = 6
+        # One worker per burst token: workers block on the bucket, not each other
+        self.max_workers = self._bucket.capacity
+    
+    def _make_request(self, endpoint, params=None, timeout=15):
+        """Make API request to Cin7, retrying 429/503 and connection errors with bounded backoff"""
+        waited = self._bucket.acquire()
+        if waited:
+            logger.info(f"Rate limiting: waited {waited:.1f}s")
+        
+        url = self.base_url + endpoint
         
         try:
             logger.info(f"Making request to: {endpoint}")
-            response = requests.get(url, headers=headers, params=params, timeout=timeout)
-            self.last_request_time = time.time()
-            
-            if response.status_code == 429:
-                logger.warning("Rate limited - waiting 60 seconds...")
-                time.sleep(60)
-                return self._make_request(endpoint, params, timeout)
-            
-            if response.status_code == 503:
-                logger.warning("Service unavailable - waiting 10 seconds...")
-                time.sleep(10)
-                return self._make_request(endpoint, params, timeout)
+            response = get_with_retries(self.session, url, params=params, timeout=timeout,
+                                        max_retries=self.max_retries, max_wait=60,
+                                        retry_statuses=_RETRY_STATUSES)
+            if response.status_code in _RETRY_STATUSES:
+                raise requests.exceptions.RetryError(
+                    f"{endpoint} still failing after {self.max_retries} attempts (HTTP {response.status_code})")
             
             response.raise_for_status()
-            return response.json()
+            # orjson decodes the raw body several times faster than response.json()
+            return orjson.loads(response.content)
             
         except requests.exceptions.Timeout:
             logger.error(f"Timeout after {timeout}s for {endpoint}")
@@ -164,15 +214,18 @@ class SimpleCin7Client:
                 if not sale_list:
                     break
                 
-                # Filter valid orders and extract basic data
-                for sale in sale_list:
-                    if sale.get('Status') != 'VOIDED' and len(orders) < max_orders:
-                        orders.append({
-                            'sale_id': sale.get('SaleID'),
-                            'order_number': sale.get('OrderNumber'),
-                            'order_date': sale.get('OrderDate', '').split('T')[0],
-                            'warehouse': self._map_location(sale.get('OrderLocationID'))
-                        })
+                # Filter valid orders and extract basic data, stopping as soon
+                # as max_orders is reached instead of mapping the whole page
+                valid = (sale for sale in sale_list if sale.get('Status') != 'VOIDED')
+                orders.extend(
+                    {
+                        'sale_id': sale.get('SaleID'),
+                        'order_number': sale.get('OrderNumber'),
+                        'order_date': sale.get('OrderDate', '')[:10],
+                        'warehouse': self._map_location(sale.get('OrderLocationID'))
+                    }
+                    for sale in islice(valid, max_orders - len(orders))
+                )
                 
                 if len(sale_list) < 100:
                     break
@@ -209,6 +262,11 @@ class SimpleCin7Client:
             logger.error(f"Failed to fetch order lines for {sale_id}: {e}")
             return []
     
+    def fetch_order_lines_bulk(self, sale_ids):
+        """Fetch order lines for many sales concurrently, returns {sale_id: lines}"""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(sale_ids, pool.map(self.fetch_order_lines, sale_ids)))
+    
     def _map_location(self, location_id):
         """Simple location mapping - enhance later"""
         # For MVP, return a default
@@ -248,42 +306,35 @@ def sync_sales():
                 'orders_processed': 0
             })
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        total_lines = 0
+        # Get every order's detailed lines concurrently (paced by the client's
+        # token bucket), before opening the write transaction so the lock is
+        # never held across HTTP calls
+        product_rows = []
+        seen_skus = set()
+        sales_rows = []
         processed_orders = 0
         
-        # For each order, get the detailed lines
+        lines_by_sale = cin7.fetch_order_lines_bulk([order['sale_id'] for order in orders])
+        
         for i, order in enumerate(orders):
             logger.info(f"Processing order {i+1}/{len(orders)}: {order['order_number']}")
             
             try:
-                lines = cin7.fetch_order_lines(order['sale_id'])
+                lines = lines_by_sale[order['sale_id']]
                 
                 for line in lines:
                     if line['sku'] and line['quantity'] > 0:
-                        # Store product if not exists
-                        cursor.execute('''
-                            INSERT OR IGNORE INTO products (sku, description)
-                            VALUES (?, ?)
-                        ''', (line['sku'], line['description']))
-                        
-                        # Store sale
-                        cursor.execute('''
-                            INSERT INTO sales (sku, quantity, sale_date, warehouse, order_number)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (
+                        if line['sku'] not in seen_skus:
+                            seen_skus.add(line['sku'])
+                            product_rows.append((line['sku'], line['description']))
+                        sales_rows.append((
                             line['sku'],
                             line['quantity'],
                             order['order_date'],
                             order['warehouse'],
                             order['order_number']
                         ))
-                        
-                        total_lines += 1
                 
-                conn.commit()
                 processed_orders += 1
                 
                 # Progress feedback
@@ -293,7 +344,39 @@ def sync_sales():
                 logger.error(f"Failed to process order {order['order_number']}: {e}")
                 continue
         
-        conn.close()
+        total_lines = len(sales_rows)
+        
+        conn = get_db()
+        cursor = conn.cursor()
+        
+        try:
+            # One transaction (one commit) for the whole sync
+            cursor.execute('BEGIN IMMEDIATE')
+            
+            # Store products if not exists: only SKUs the table doesn't have yet
+            # reach the INSERT (first description seen wins, as before)
+            cursor.execute('SELECT sku FROM products')
+            known_skus = {row[0] for row in cursor}
+            product_rows = [row for row in product_rows if row[0] not in known_skus]
+            
+            cursor.executemany('''
+                INSERT OR IGNORE INTO products (sku, description)
+                VALUES (?, ?)
+            ''', product_rows)
+            
+            # Store sales
+            cursor.executemany('''
+                INSERT INTO sales (sku, quantity, sale_date, warehouse, order_number)
+                VALUES (?, ?, ?, ?, ?)
+            ''', sales_rows)
+            
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        
+        # A sync is the big write burst; refresh planner stats while it's fresh
+        cursor.execute('PRAGMA optimize')
         
         return jsonify({
             'success': True,
@@ -325,8 +408,8 @@ def calculate_velocity(sku):
                 MAX(sale_date) as last_sale
             FROM sales 
             WHERE sku = ? 
-            AND sale_date >= date('now', '-{} days')
-        '''.format(days), (sku,))
+            AND sale_date >= date('now', ?)
+        ''', (sku, f'-{days} days'))
         
         result = cursor.fetchone()
         
@@ -349,8 +432,6 @@ def calculate_velocity(sku):
         cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
         product = cursor.fetchone()
         
-        conn.close()
-        
         return jsonify({
             'sku': sku,
             'description': product['description'] if product else '',
@@ -394,7 +475,7 @@ def sync_sales_simple():
             'sample_orders': [
                 {
                     'order_number': o.get('OrderNumber'),
-                    'order_date': o.get('OrderDate', '').split('T')[0],
+                    'order_date': o.get('OrderDate', '')[:10],
                     'status': o.get('Status')
                 } for o in valid_orders[:3]
             ],
@@ -412,17 +493,15 @@ def stock_status():
         conn = get_db()
         cursor = conn.cursor()
         
-        # Get basic stats
-        cursor.execute('SELECT COUNT(DISTINCT sku) FROM products')
-        total_skus = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(DISTINCT sku) FROM sales WHERE sale_date >= date("now", "-30 days")')
-        active_skus = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM sales WHERE sale_date >= date("now", "-7 days")')
-        recent_sales = cursor.fetchone()[0]
-        
-        conn.close()
+        # Get basic stats in one statement; each sales count is a range
+        # scan on idx_sales_date
+        cursor.execute('''
+            SELECT
+                (SELECT COUNT(DISTINCT sku) FROM products) as total_skus,
+                (SELECT COUNT(DISTINCT sku) FROM sales WHERE sale_date >= date('now', '-30 days')) as active_skus,
+                (SELECT COUNT(*) FROM sales WHERE sale_date >= date('now', '-7 days')) as recent_sales
+        ''')
+        total_skus, active_skus, recent_sales = cursor.fetchone()
         
         return jsonify({
             'total_skus': total_skus,
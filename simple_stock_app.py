@@ -7,20 +7,99 @@ from flask_cors import CORS
 from dotenv import load_dotenv
 import sqlite3
 import os
-from datetime import datetime, timedelta
+import threading
+import time
 import logging
+import numpy as np
+from json_provider import OrjsonProvider
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
+DATABASE = 'stock_forecast.db'
+
+# Applied to every connection (journal_mode=WAL also persists in the file):
+# dashboard reads no longer block on a sync's writes
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA mmap_size=268435456',
+)
+
+# One connection per worker thread, reused for the life of the process
+_local = threading.local()
+
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect('stock_forecast.db')
-    conn.row_factory = sqlite3.Row
+    """Get this thread's database connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
     return conn
 
+def init_db():
+    """Index the analysis queries (the orders table itself is created by the sync service)"""
+    conn = sqlite3.connect(DATABASE)
+    try:
+        # Same covering index rate_limited_sync creates: SKU + date range + SUM(quantity)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_sku_date ON orders(sku, booking_date, quantity)')
+        conn.execute('ANALYZE')
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Skipping index setup, orders not synced yet: {e}")
+    finally:
+        conn.close()
+
+@app.teardown_appcontext
+def _end_transaction(exc):
+    """Never hand a reused connection to the next request mid-transaction"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# /api/stock/analysis results, keyed on the parameters plus the newest order
+# id: orders are only ever inserted, so a sync run by the separate sync
+# service changes the key and the next request recomputes. The TTL bounds
+# staleness from the rolling date window
+ANALYSIS_CACHE_TTL = 60
+_analysis_cache = {}
+_analysis_cache_lock = threading.Lock()
+
+def _cached_analysis(params):
+    """Return the analysis payload for params, recomputing when orders changed or the entry expired"""
+    conn = get_db()
+    latest_order_id = conn.execute('SELECT MAX(id) FROM orders').fetchone()[0]
+    key = (params, latest_order_id)
+    now = time.monotonic()
+    
+    with _analysis_cache_lock:
+        entry = _analysis_cache.get(key)
+    if entry and entry[0] > now:
+        return entry[1]
+    
+    payload = _compute_analysis(conn, *params)
+    
+    with _analysis_cache_lock:
+        # Drop entries for older data or past their TTL
+        for stale in [k for k, (expires, _) in _analysis_cache.items()
+                      if k[1] != latest_order_id or expires <= now]:
+            del _analysis_cache[stale]
+        _analysis_cache[key] = (now + ANALYSIS_CACHE_TTL, payload)
+    return payload
+
+# Initialize
+init_db()
+
 @app.route('/')
 def dashboard():
     """Main dashboard"""
@@ -44,8 +123,6 @@ def dashboard_overview():
         cursor.execute('SELECT MAX(booking_date) as latest_order FROM orders')
         latest_order = cursor.fetchone()['latest_order']
         
-        conn.close()
-        
         return jsonify({
             'total_skus': total_skus,
             'total_orders': total_orders,
@@ -65,117 +142,126 @@ def stock_analysis():
         buffer_months = float(request.args.get('buffer_months', 1))
         growth_rate = float(request.args.get('growth_rate', 0))  # % monthly growth
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get sales data (using broad date range to include our 2024 data)
-        cursor.execute('''
-            SELECT 
-                sku,
-                SUM(quantity) as total_quantity,
-                COUNT(*) as order_count,
-                MIN(booking_date) as first_sale,
-                MAX(booking_date) as last_sale
-            FROM orders 
-            WHERE booking_date >= date('now', '-500 days')
-            GROUP BY sku
-            HAVING total_quantity > 0
-            ORDER BY total_quantity DESC
-        ''')
-        
-        analysis_data = []
-        
-        for row in cursor.fetchall():
-            sku = row['sku']
-            total_qty = row['total_quantity']
-            
-            # Calculate actual sales velocity
-            if row['first_sale'] and row['last_sale']:
-                first_date = datetime.strptime(row['first_sale'], '%Y-%m-%d')
-                last_date = datetime.strptime(row['last_sale'], '%Y-%m-%d')
-                actual_days = (last_date - first_date).days + 1
-            else:
-                actual_days = 1
-            
-            daily_velocity = total_qty / actual_days
-            monthly_velocity = daily_velocity * 30
-            
-            # Apply growth rate to velocity
-            adjusted_monthly_velocity = monthly_velocity * (1 + growth_rate / 100)
-            adjusted_daily_velocity = adjusted_monthly_velocity / 30
-            
-            # Calculate current stock (mock for now)
-            current_stock = max(0, 100 - total_qty)  # Mock: started with 100, subtract sales
-            
-            # Simple reorder calculation
-            lead_time_demand = lead_time_days * adjusted_daily_velocity
-            buffer_stock = buffer_months * adjusted_monthly_velocity
-            reorder_point = lead_time_demand + buffer_stock
-            
-            # How much to order
-            order_quantity = max(0, reorder_point - current_stock)
-            
-            # Days until stockout
-            days_until_stockout = current_stock / adjusted_daily_velocity if adjusted_daily_velocity > 0 else 999
-            
-            # Simple status
-            if days_until_stockout <= lead_time_days:
-                status = 'URGENT'
-                status_color = 'red'
-            elif current_stock < reorder_point:
-                status = 'REORDER NEEDED'
-                status_color = 'orange'
-            else:
-                status = 'OK'
-                status_color = 'green'
-            
-            # Get description
-            cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
-            product = cursor.fetchone()
-            
-            analysis_data.append({
-                'sku': sku,
-                'description': product['description'] if product else '',
-                'current_stock': round(current_stock, 0),
-                'daily_velocity': round(adjusted_daily_velocity, 2),
-                'monthly_velocity': round(adjusted_monthly_velocity, 1),
-                'reorder_point': round(reorder_point, 0),
-                'order_quantity': round(order_quantity, 0),
-                'days_until_stockout': round(days_until_stockout, 0),
-                'status': status,
-                'status_color': status_color,
-                'lead_time_demand': round(lead_time_demand, 1),
-                'buffer_stock': round(buffer_stock, 1)
-            })
-        
-        # Sort by urgency (lowest days until stockout first)
-        analysis_data.sort(key=lambda x: x['days_until_stockout'])
-        
-        conn.close()
-        
-        # Summary stats
-        total_skus = len(analysis_data)
-        needs_reorder = len([x for x in analysis_data if x['status'] != 'OK'])
-        urgent_items = len([x for x in analysis_data if x['status'] == 'URGENT'])
-        
-        return jsonify({
-            'success': True,
-            'parameters': {
-                'lead_time_days': lead_time_days,
-                'buffer_months': buffer_months,
-                'growth_rate': growth_rate
-            },
-            'summary': {
-                'total_skus': total_skus,
-                'needs_reorder': needs_reorder,
-                'urgent_items': urgent_items
-            },
-            'data': analysis_data
-        })
+        return jsonify(_cached_analysis((lead_time_days, buffer_months, growth_rate)))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _compute_analysis(conn, lead_time_days, buffer_months, growth_rate):
+    """Reorder analysis for every SKU sold in the window, as the /api/stock/analysis payload"""
+    cursor = conn.cursor()
+    
+    # Get sales data (using broad date range to include our 2024 data),
+    # with each SKU's description joined in rather than looked up per row
+    cursor.execute('''
+        SELECT 
+            o.sku,
+            SUM(o.quantity) as total_quantity,
+            COUNT(*) as order_count,
+            MIN(o.booking_date) as first_sale,
+            MAX(o.booking_date) as last_sale,
+            COALESCE(CAST(julianday(MAX(o.booking_date)) - julianday(MIN(o.booking_date)) AS INTEGER) + 1, 1) as actual_days,
+            p.description
+        FROM orders o
+        LEFT JOIN products p ON p.sku = o.sku
+        WHERE o.booking_date >= date('now', '-500 days')
+        GROUP BY o.sku
+        HAVING total_quantity > 0
+        ORDER BY total_quantity DESC
+    ''')
+    
+    rows = cursor.fetchall()
+    
+    # Whole-array math over all SKUs at once
+    total_qty = np.array([row['total_quantity'] for row in rows], dtype=np.float64)
+    actual_days = np.array([row['actual_days'] for row in rows], dtype=np.float64)
+    
+    # Calculate actual sales velocity
+    daily_velocity = total_qty / actual_days
+    monthly_velocity = daily_velocity * 30
+    
+    # Apply growth rate to velocity
+    adjusted_monthly_velocity = monthly_velocity * (1 + growth_rate / 100)
+    adjusted_daily_velocity = adjusted_monthly_velocity / 30
+    
+    # Calculate current stock (mock for now)
+    current_stock = np.maximum(0, 100 - total_qty)  # Mock: started with 100, subtract sales
+    
+    # Simple reorder calculation
+    lead_time_demand = lead_time_days * adjusted_daily_velocity
+    buffer_stock = buffer_months * adjusted_monthly_velocity
+    reorder_point = lead_time_demand + buffer_stock
+    
+    # How much to order
+    order_quantity = np.maximum(0, reorder_point - current_stock)
+    
+    # Days until stockout
+    days_until_stockout = np.divide(current_stock, adjusted_daily_velocity,
+                                    out=np.full(len(rows), 999.0), where=adjusted_daily_velocity > 0)
+    
+    # Simple status
+    urgent = days_until_stockout <= lead_time_days
+    reorder = ~urgent & (current_stock < reorder_point)
+    status = np.select([urgent, reorder], ['URGENT', 'REORDER NEEDED'], 'OK')
+    status_color = np.select([urgent, reorder], ['red', 'orange'], 'green')
+    
+    # Sort by urgency (lowest days until stockout first)
+    days_until_stockout = np.round(days_until_stockout)
+    order = np.argsort(days_until_stockout, kind='stable')
+    
+    # Rounding stays per value: round() rounds the exact decimal value,
+    # which np.round does not for halves like 0.175
+    columns = zip(
+        order.tolist(),
+        current_stock[order].tolist(),
+        adjusted_daily_velocity[order].tolist(),
+        adjusted_monthly_velocity[order].tolist(),
+        reorder_point[order].tolist(),
+        order_quantity[order].tolist(),
+        days_until_stockout[order].tolist(),
+        status[order].tolist(),
+        status_color[order].tolist(),
+        lead_time_demand[order].tolist(),
+        buffer_stock[order].tolist()
+    )
+    analysis_data = [
+        {
+            'sku': rows[i]['sku'],
+            'description': rows[i]['description'] or '',
+            'current_stock': round(stock, 0),
+            'daily_velocity': round(daily, 2),
+            'monthly_velocity': round(monthly, 1),
+            'reorder_point': round(point, 0),
+            'order_quantity': round(qty, 0),
+            'days_until_stockout': days,
+            'status': label,
+            'status_color': color,
+            'lead_time_demand': round(demand, 1),
+            'buffer_stock': round(buffer, 1)
+        }
+        for i, stock, daily, monthly, point, qty, days, label, color, demand, buffer in columns
+    ]
+    
+    # Summary stats
+    total_skus = len(analysis_data)
+    needs_reorder = int((urgent | reorder).sum())
+    urgent_items = int(urgent.sum())
+    
+    return {
+        'success': True,
+        'parameters': {
+            'lead_time_days': lead_time_days,
+            'buffer_months': buffer_months,
+            'growth_rate': growth_rate
+        },
+        'summary': {
+            'total_skus': total_skus,
+            'needs_reorder': needs_reorder,
+            'urgent_items': urgent_items
+        },
+        'data': analysis_data
+    }
+
 @app.route('/api/sku/<sku>/forecast')
 def sku_forecast(sku):
     """Simple forecast for a specific SKU"""
@@ -190,8 +276,7 @@ def sku_forecast(sku):
         cursor.execute('''
             SELECT 
                 SUM(quantity) as total_quantity,
-                MIN(booking_date) as first_sale,
-                MAX(booking_date) as last_sale
+                COALESCE(CAST(julianday(MAX(booking_date)) - julianday(MIN(booking_date)) AS INTEGER) + 1, 1) as actual_days
             FROM orders 
             WHERE sku = ? 
             AND booking_date >= date('now', '-500 days')
@@ -205,15 +290,8 @@ def sku_forecast(sku):
                 'error': 'No sales data found'
             })
         
-        # Calculate velocity
-        if result['first_sale'] and result['last_sale']:
-            first_date = datetime.strptime(result['first_sale'], '%Y-%m-%d')
-            last_date = datetime.strptime(result['last_sale'], '%Y-%m-%d')
-            actual_days = (last_date - first_date).days + 1
-        else:
-            actual_days = 1
-        
-        daily_velocity = result['total_quantity'] / actual_days
+        # Calculate velocity (day span comes from SQLite, no per-request date parsing)
+        daily_velocity = result['total_quantity'] / result['actual_days']
         monthly_velocity = daily_velocity * 30
         
         # Apply growth rate
@@ -222,25 +300,24 @@ def sku_forecast(sku):
         # Mock current stock
         current_stock = max(0, 100 - result['total_quantity'])
         
-        # Generate monthly forecast
-        forecast = []
-        projected_stock = current_stock
+        # Generate monthly forecast: consumption is linear, so every month at once
+        months = np.arange(1, months_ahead + 1)
+        projected = np.maximum(0, current_stock - adjusted_monthly_velocity * months)
+        stockout_mask = projected <= 0
         
-        for month in range(1, months_ahead + 1):
-            projected_consumption = adjusted_monthly_velocity * month
-            projected_stock = max(0, current_stock - projected_consumption)
-            
-            forecast.append({
+        monthly_consumption = round(adjusted_monthly_velocity, 1)
+        forecast = [
+            {
                 'month': month,
                 'projected_stock': round(projected_stock, 0),
-                'monthly_consumption': round(adjusted_monthly_velocity, 1),
-                'stockout_risk': projected_stock <= 0
-            })
+                'monthly_consumption': monthly_consumption,
+                'stockout_risk': risk
+            }
+            for month, projected_stock, risk in zip(months.tolist(), projected.tolist(), stockout_mask.tolist())
+        ]
         
         # Find stockout month
-        stockout_month = next((f['month'] for f in forecast if f['stockout_risk']), None)
-        
-        conn.close()
+        stockout_month = int(months[stockout_mask][0]) if stockout_mask.any() else None
         
         return jsonify({
             'sku': sku,
@@ -8,8 +8,12 @@ from dotenv import load_dotenv
 from datetime import datetime, timedelta
 import sqlite3
 import logging
+import threading
+import time
+import numpy as np
 
 from sync_manager import SyncManager
+from json_provider import OrjsonProvider
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -19,17 +23,81 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Initialize sync manager
 sync_manager = SyncManager()
 
+# Applied once per connection (journal_mode=WAL also persists in the file):
+# readers no longer block behind a sync's writes
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+)
+
+# One connection per worker thread, reused for the life of the process
+_local = threading.local()
+
 def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect('stock_forecast.db')
-    conn.row_factory = sqlite3.Row
+    """Get this thread's database connection"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect('stock_forecast.db')
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
     return conn
 
+@app.teardown_appcontext
+def _end_transaction(exc):
+    """Never hand a reused connection to the next request mid-transaction"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+# Response bodies of the read-only analytical routes, reused until they expire
+# or a live sync from this app stores new orders
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_MAX_ENTRIES = 256  # keys include the free-form SKU and warehouse
+_response_cache = {}  # key -> (expires, value), oldest first
+_cache_generation = 0
+_cache_lock = threading.Lock()
+
+def _cached(key, ttl, compute):
+    """Return the cached value for key, computing and storing it if missing or expired"""
+    now = time.monotonic()
+    with _cache_lock:
+        hit = _response_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        generation = _cache_generation
+    
+    value = compute()
+    
+    with _cache_lock:
+        # Don't store a result computed from data a sync has since replaced
+        if generation == _cache_generation:
+            # Drop expired entries, then the oldest ones past the size cap
+            for stale in [k for k, (expires, _) in _response_cache.items() if expires <= now]:
+                del _response_cache[stale]
+            _response_cache.pop(key, None)
+            while len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+                del _response_cache[next(iter(_response_cache))]
+            _response_cache[key] = (now + ttl, value)
+    return value
+
+def invalidate_response_cache():
+    """Drop all cached responses (call after new orders are stored)"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _response_cache.clear()
+
 @app.route('/health')
 def health():
     return jsonify({
@@ -53,6 +121,8 @@ def sync_test_week():
     logger.info(f"Starting {'DRY RUN' if dry_run else 'LIVE'} sync for last {days} days")
     
     result = sync_manager.sync_week_of_orders(days_back=days, dry_run=dry_run)
+    if not dry_run:
+        invalidate_response_cache()
     return jsonify(result)
 
 @app.route('/sync/incremental')
@@ -64,8 +134,66 @@ def sync_incremental():
     logger.info(f"Starting {'DRY RUN' if dry_run else 'LIVE'} incremental sync")
     
     result = sync_manager.sync_recent_orders(max_pages=max_pages, dry_run=dry_run)
+    if not dry_run:
+        invalidate_response_cache()
     return jsonify(result)
 
+def _velocity_payload(sku, days, warehouse):
+    """Sales velocity response body for one SKU"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Build query with optional warehouse filter
+    where_clause = "WHERE sku = ? AND booking_date >= date('now', ?)"
+    params = [sku, f'-{days} days']
+    
+    if warehouse:
+        where_clause += ' AND warehouse = ?'
+        params.append(warehouse)
+    
+    cursor.execute(f'''
+        SELECT 
+            SUM(quantity) as total_quantity,
+            COUNT(*) as order_count,
+            MIN(booking_date) as first_sale,
+            MAX(booking_date) as last_sale
+        FROM orders 
+        {where_clause}
+    ''', params)
+    
+    result = cursor.fetchone()
+    
+    if not result or not result['total_quantity']:
+        return {
+            'sku': sku,
+            'warehouse': warehouse,
+            'daily_velocity': 0,
+            'weekly_velocity': 0,
+            'monthly_velocity': 0,
+            'message': 'No sales data found'
+        }
+    
+    total_qty = result['total_quantity']
+    daily_velocity = total_qty / days
+    
+    # Get product info
+    cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
+    product = cursor.fetchone()
+    
+    return {
+        'sku': sku,
+        'warehouse': warehouse or 'ALL',
+        'description': product['description'] if product else '',
+        'period_days': days,
+        'total_quantity_sold': total_qty,
+        'order_count': result['order_count'],
+        'daily_velocity': round(daily_velocity, 2),
+        'weekly_velocity': round(daily_velocity * 7, 2),
+        'monthly_velocity': round(daily_velocity * 30, 2),
+        'first_sale': result['first_sale'],
+        'last_sale': result['last_sale']
+    }
+
 @app.route('/velocity/<sku>')
 def calculate_velocity(sku):
     """Calculate sales velocity for a SKU"""
@@ -73,65 +201,105 @@ def calculate_velocity(sku):
         days = int(request.args.get('days', 30))
         warehouse = request.args.get('warehouse')  # Optional filter
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Build query with optional warehouse filter
-        where_clause = 'WHERE sku = ? AND booking_date >= date("now", "-{} days")'.format(days)
-        params = [sku]
-        
-        if warehouse:
-            where_clause += ' AND warehouse = ?'
-            params.append(warehouse)
-        
-        cursor.execute(f'''
-            SELECT 
-                SUM(quantity) as total_quantity,
-                COUNT(*) as order_count,
-                MIN(booking_date) as first_sale,
-                MAX(booking_date) as last_sale
-            FROM orders 
-            {where_clause}
-        ''', params)
-        
-        result = cursor.fetchone()
-        
-        if not result or not result['total_quantity']:
-            return jsonify({
-                'sku': sku,
-                'warehouse': warehouse,
-                'daily_velocity': 0,
-                'weekly_velocity': 0,
-                'monthly_velocity': 0,
-                'message': 'No sales data found'
-            })
-        
-        total_qty = result['total_quantity']
-        daily_velocity = total_qty / days
-        
-        # Get product info
-        cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
-        product = cursor.fetchone()
-        
-        conn.close()
-        
-        return jsonify({
-            'sku': sku,
-            'warehouse': warehouse or 'ALL',
-            'description': product['description'] if product else '',
-            'period_days': days,
-            'total_quantity_sold': total_qty,
-            'order_count': result['order_count'],
-            'daily_velocity': round(daily_velocity, 2),
-            'weekly_velocity': round(daily_velocity * 7, 2),
-            'monthly_velocity': round(daily_velocity * 30, 2),
-            'first_sale': result['first_sale'],
-            'last_sale': result['last_sale']
-        })
+        return jsonify(_cached(
+            ('velocity', sku, days, warehouse), RESPONSE_CACHE_TTL,
+            lambda: _velocity_payload(sku, days, warehouse)
+        ))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _reorder_payload(lead_time_days, service_level, review_days, warehouse):
+    """Reorder points response body for every SKU sold in the last 90 days"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Mock current stock for MVP (replace with actual Cin7 stock API later)
+    current_stock = 50  # Placeholder
+    
+    # Every SKU with sales in the last 90 days, with its 30-day totals and
+    # description, in one grouped query (SKUs quiet for the last 30 days
+    # still appear, with zero velocity), already sorted by urgency: lowest
+    # days until stockout first, ties by SKU
+    where_clause = "WHERE o.booking_date >= date('now', '-90 days')"
+    params = []
+    
+    if warehouse:
+        where_clause += ' AND o.warehouse = ?'
+        params.append(warehouse)
+    
+    cursor.execute(f'''
+        SELECT 
+            o.sku,
+            SUM(CASE WHEN o.booking_date >= date('now', '-30 days') THEN o.quantity ELSE 0 END) as total_qty,
+            COUNT(CASE WHEN o.booking_date >= date('now', '-30 days') THEN 1 END) as order_count,
+            p.description
+        FROM orders o
+        LEFT JOIN products p ON p.sku = o.sku
+        {where_clause}
+        GROUP BY o.sku
+        ORDER BY CASE WHEN total_qty > 0 THEN ? * 30.0 / total_qty ELSE 999 END, o.sku
+    ''', params + [current_stock])
+    
+    rows = cursor.fetchall()
+    
+    # Whole-array math over all SKUs at once
+    total_qty = np.array([row['total_qty'] or 0 for row in rows], dtype=np.float64)
+    daily_velocity = total_qty / 30
+    
+    # Calculate reorder point (proven formula)
+    demand_during_lead_time = (lead_time_days + review_days) * daily_velocity
+    
+    # Safety stock calculation
+    safety_factor = 1.65 if service_level >= 95 else 1.28
+    safety_stock = safety_factor * daily_velocity * (lead_time_days ** 0.5)
+    
+    reorder_point = demand_during_lead_time + safety_stock
+    recommended_qty = np.maximum(0, reorder_point - current_stock)
+    needs_reorder = current_stock < reorder_point
+    days_until_stockout = np.round(np.divide(current_stock, daily_velocity,
+                                             out=np.full(len(rows), 999.0), where=daily_velocity > 0))
+    
+    # round() per value keeps the exact-decimal rounding the loop had
+    columns = zip(
+        rows,
+        daily_velocity.tolist(),
+        reorder_point.tolist(),
+        safety_stock.tolist(),
+        recommended_qty.tolist(),
+        needs_reorder.tolist(),
+        days_until_stockout.tolist()
+    )
+    reorder_data = [
+        {
+            'sku': row['sku'],
+            'description': row['description'] or '',
+            'warehouse': warehouse or 'ALL',
+            'current_stock': current_stock,
+            'daily_velocity': round(velocity, 2),
+            'order_count_30d': row['order_count'] or 0,
+            'reorder_point': round(point, 0),
+            'safety_stock': round(safety, 0),
+            'recommended_order_qty': round(qty, 0),
+            'needs_reorder': reorder,
+            'days_until_stockout': days
+        }
+        for row, velocity, point, safety, qty, reorder, days in columns
+    ]
+    
+    return {
+        'success': True,
+        'parameters': {
+            'lead_time_days': lead_time_days,
+            'service_level': service_level,
+            'review_days': review_days,
+            'warehouse': warehouse
+        },
+        'total_skus': len(reorder_data),
+        'needs_reorder': int(needs_reorder.sum()),
+        'data': reorder_data
+    }
+
 @app.route('/reorder-points')
 def calculate_reorder_points():
     """Calculate reorder points for all active SKUs"""
@@ -142,172 +310,90 @@ def calculate_reorder_points():
         review_days = int(request.args.get('review_days', 7))
         warehouse = request.args.get('warehouse')  # Optional filter
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get all SKUs with recent sales
-        where_clause = 'WHERE booking_date >= date("now", "-90 days")'
-        params = []
-        
-        if warehouse:
-            where_clause += ' AND warehouse = ?'
-            params.append(warehouse)
-        
-        cursor.execute(f'''
-            SELECT DISTINCT sku 
-            FROM orders 
-            {where_clause}
-        ''', params)
-        
-        skus = [row['sku'] for row in cursor.fetchall()]
-        
-        reorder_data = []
-        
-        for sku in skus:
-            # Calculate 30-day velocity
-            velocity_params = [sku]
-            velocity_where = 'WHERE sku = ? AND booking_date >= date("now", "-30 days")'
-            
-            if warehouse:
-                velocity_where += ' AND warehouse = ?'
-                velocity_params.append(warehouse)
-            
-            cursor.execute(f'''
-                SELECT SUM(quantity) as total_qty, COUNT(*) as order_count
-                FROM orders 
-                {velocity_where}
-            ''', velocity_params)
-            
-            result = cursor.fetchone()
-            total_qty = result['total_qty'] or 0
-            order_count = result['order_count'] or 0
-            daily_velocity = total_qty / 30
-            
-            # Mock current stock for MVP (replace with actual Cin7 stock API later)
-            current_stock = 50  # Placeholder
-            
-            # Calculate reorder point (proven formula)
-            demand_during_lead_time = (lead_time_days + review_days) * daily_velocity
-            
-            # Safety stock calculation
-            safety_factor = 1.65 if service_level >= 95 else 1.28
-            safety_stock = safety_factor * daily_velocity * (lead_time_days ** 0.5)
-            
-            reorder_point = demand_during_lead_time + safety_stock
-            recommended_qty = max(0, reorder_point - current_stock)
-            
-            # Get description
-            cursor.execute('SELECT description FROM products WHERE sku = ?', (sku,))
-            product = cursor.fetchone()
-            
-            reorder_data.append({
-                'sku': sku,
-                'description': product['description'] if product else '',
-                'warehouse': warehouse or 'ALL',
-                'current_stock': current_stock,
-                'daily_velocity': round(daily_velocity, 2),
-                'order_count_30d': order_count,
-                'reorder_point': round(reorder_point, 0),
-                'safety_stock': round(safety_stock, 0),
-                'recommended_order_qty': round(recommended_qty, 0),
-                'needs_reorder': current_stock < reorder_point,
-                'days_until_stockout': round(current_stock / daily_velocity, 0) if daily_velocity > 0 else 999
-            })
-        
-        # Sort by urgency
-        reorder_data.sort(key=lambda x: x['days_until_stockout'])
-        
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'parameters': {
-                'lead_time_days': lead_time_days,
-                'service_level': service_level,
-                'review_days': review_days,
-                'warehouse': warehouse
-            },
-            'total_skus': len(reorder_data),
-            'needs_reorder': len([x for x in reorder_data if x['needs_reorder']]),
-            'data': reorder_data
-        })
+        return jsonify(_cached(
+            ('reorder', lead_time_days, service_level, review_days, warehouse), RESPONSE_CACHE_TTL,
+            lambda: _reorder_payload(lead_time_days, service_level, review_days, warehouse)
+        ))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _summary_payload():
+    """Synced data summary response body"""
+    conn = get_db()
+    cursor = conn.cursor()
+    
+    # Overall stats
+    cursor.execute('SELECT COUNT(*) FROM products')
+    total_products = cursor.fetchone()[0]
+    
+    cursor.execute('SELECT COUNT(*) FROM orders')
+    total_orders = cursor.fetchone()[0]
+    
+    # Recent activity
+    cursor.execute('''
+        SELECT 
+            warehouse,
+            COUNT(*) as order_count,
+            SUM(quantity) as total_quantity
+        FROM orders 
+        WHERE booking_date >= date('now', '-30 days')
+        GROUP BY warehouse
+    ''')
+    
+    warehouse_activity = []
+    for row in cursor.fetchall():
+        warehouse_activity.append({
+            'warehouse': row['warehouse'],
+            'orders': row['order_count'],
+            'total_quantity': row['total_quantity']
+        })
+    
+    # Top SKUs by volume, with descriptions joined in
+    cursor.execute('''
+        SELECT 
+            o.sku,
+            SUM(o.quantity) as total_quantity,
+            COUNT(*) as order_count,
+            p.description
+        FROM orders o
+        LEFT JOIN products p ON p.sku = o.sku
+        WHERE o.booking_date >= date('now', '-30 days')
+        GROUP BY o.sku
+        ORDER BY total_quantity DESC
+        LIMIT 10
+    ''')
+    
+    top_skus = [
+        {
+            'sku': row['sku'],
+            'description': row['description'] or '',
+            'total_quantity': row['total_quantity'],
+            'order_count': row['order_count']
+        }
+        for row in cursor.fetchall()
+    ]
+    
+    return {
+        'success': True,
+        'summary': {
+            'total_products': total_products,
+            'total_orders': total_orders,
+            'warehouse_activity': warehouse_activity,
+            'top_skus_30d': top_skus
+        }
+    }
+
 @app.route('/data/summary')
 def data_summary():
     """Get summary of synced data"""
     try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Overall stats
-        cursor.execute('SELECT COUNT(*) FROM products')
-        total_products = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) FROM orders')
-        total_orders = cursor.fetchone()[0]
-        
-        # Recent activity
-        cursor.execute('''
-            SELECT 
-                warehouse,
-                COUNT(*) as order_count,
-                SUM(quantity) as total_quantity
-            FROM orders 
-            WHERE booking_date >= date('now', '-30 days')
-            GROUP BY warehouse
-        ''')
-        
-        warehouse_activity = []
-        for row in cursor.fetchall():
-            warehouse_activity.append({
-                'warehouse': row['warehouse'],
-                'orders': row['order_count'],
-                'total_quantity': row['total_quantity']
-            })
-        
-        # Top SKUs by volume
-        cursor.execute('''
-            SELECT 
-                sku,
-                SUM(quantity) as total_quantity,
-                COUNT(*) as order_count
-            FROM orders 
-            WHERE booking_date >= date('now', '-30 days')
-            GROUP BY sku
-            ORDER BY total_quantity DESC
-            LIMIT 10
-        ''')
-        
-        top_skus = []
-        for row in cursor.fetchall():
-            cursor.execute('SELECT description FROM products WHERE sku = ?', (row['sku'],))
-            product = cursor.fetchone()
-            
-            top_skus.append({
-                'sku': row['sku'],
-                'description': product['description'] if product else '',
-                'total_quantity': row['total_quantity'],
-                'order_count': row['order_count']
-            })
-        
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'summary': {
-                'total_products': total_products,
-                'total_orders': total_orders,
-                'warehouse_activity': warehouse_activity,
-                'top_skus_30d': top_skus
-            }
-        })
+        return jsonify(_cached(('summary',), RESPONSE_CACHE_TTL, _summary_payload))
         
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+
 if __name__ == '__main__':
     print("🚀 Stock Forecasting App Starting...")
     print("📊 Database: SQLite")
@@ -1,29 +1,46 @@
 """
 Stock calculation and management module
 """
+from collections import defaultdict
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
-from sqlalchemy import func
+from sqlalchemy import func, insert
+from sqlalchemy.dialects import postgresql, sqlite
 from database import db, Product, Order, OrderLine, StockLevel, ForecastConfig
 import logging
 
 logger = logging.getLogger(__name__)
 
+# INSERT constructs with ON CONFLICT support, for the backends database.py targets
+UPSERT_INSERTS = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
 
 class StockCalculator:
     """Handles stock calculations and database operations"""
     
     def __init__(self, database):
         self.db = database
+        # SKU -> products.id for the batch being staged; None until first needed
+        self._sku_index = None
+    
+    def _upsert_insert(self, table):
+        """INSERT for table with the ON CONFLICT clauses of the engine's dialect"""
+        return UPSERT_INSERTS[self.db.engine.dialect.name](table)
     
-    def store_order(self, order_data: Dict) -> bool:
-        """Store order from Cin7 in database"""
+    def store_order(self, order_data: Dict, commit: bool = True) -> bool:
+        """
+        Store order from Cin7 in database
+        
+        Written with Core statements rather than ORM objects: one INSERT for the
+        order (skipped on a cin7_id conflict, i.e. already stored) and one
+        executemany for its lines, together in a savepoint so a bad order never
+        leaves a partial write behind. With commit=False nothing is committed:
+        stage a whole sync this way and call flush_batch() once.
+        """
         try:
-            # Check if order already exists
-            existing = Order.query.filter_by(cin7_id=order_data.get('SaleID')).first()
-            if existing:
-                return False
-            
             # Parse order date
             order_date = None
             if order_data.get('OrderDate'):
@@ -32,175 +49,213 @@ class StockCalculator:
                 except:
                     order_date = datetime.strptime(order_data['OrderDate'][:10], '%Y-%m-%d').date()
             
-            # Create order
-            order = Order(
-                cin7_id=order_data.get('SaleID'),
-                order_number=order_data.get('OrderNumber'),
-                order_date=order_date,
-                warehouse_code=order_data.get('warehouse_code', 'UNKNOWN'),
-                status=order_data.get('Status'),
-                reference=order_data.get('Reference')
-            )
-            
-            self.db.session.add(order)
-            self.db.session.commit()
+            warehouse_code = order_data.get('warehouse_code', 'UNKNOWN')
+            insert_order = self._upsert_insert(Order.__table__).on_conflict_do_nothing(
+                index_elements=['cin7_id']
+            ).returning(Order.__table__.c.id)
             
-            # Store order lines if we have detail
-            if 'Lines' in order_data:
-                for line in order_data.get('Lines', []):
-                    self._store_order_line(order.id, line, order.warehouse_code)
+            with self.db.session.begin_nested():
+                # Create order
+                order_id = self.db.session.execute(insert_order, {
+                    'cin7_id': order_data.get('SaleID'),
+                    'order_number': order_data.get('OrderNumber'),
+                    'order_date': order_date,
+                    'warehouse_code': warehouse_code,
+                    'status': order_data.get('Status'),
+                    'reference': order_data.get('Reference')
+                }).scalar()
+                
+                # Check if order already exists
+                if order_id is None:
+                    return False
+                
+                # Store order lines if we have detail
+                lines = self._build_order_lines(order_id, order_data.get('Lines', []), warehouse_code)
+                if lines:
+                    self.db.session.execute(insert(OrderLine.__table__), lines)
             
+            if commit:
+                self.db.session.commit()
+                self._end_batch()
             return True
             
         except Exception as e:
             logger.error(f"Failed to store order: {e}")
-            self.db.session.rollback()
+            if commit:
+                self.db.session.rollback()
+                self._end_batch()
             return False
     
-    def _store_order_line(self, order_id: int, line_data: Dict, warehouse_code: str) -> bool:
-        """Store individual order line"""
+    def _load_sku_index(self) -> Dict[str, int]:
+        """SKU -> products.id for every product, read in one query"""
+        return dict(self.db.session.query(Product.sku, Product.id))
+    
+    def _end_batch(self):
+        """Forget the SKU index once a batch is committed or rolled back"""
+        self._sku_index = None
+    
+    def _build_order_lines(self, order_id: int, lines_data: List[Dict], warehouse_code: str) -> List[Dict]:
+        """order_lines rows for one order (lines without a SKU or a numeric quantity are skipped)"""
+        # Products are looked up once per batch, not per order or per line
+        if self._sku_index is None:
+            self._sku_index = self._load_sku_index()
+        
+        rows = []
+        for line in lines_data:
+            sku = line.get('SKU', '')
+            if not sku:
+                continue
+            
+            # A bad quantity loses only its own line, not the whole order
+            try:
+                quantity = float(line.get('Quantity', 0))
+            except (TypeError, ValueError):
+                logger.warning(f"Skipping line {sku} of order {order_id}: bad quantity {line.get('Quantity')!r}")
+                continue
+            
+            rows.append({
+                'order_id': order_id,
+                'product_id': self._sku_index.get(sku),
+                'sku': sku,
+                'quantity': quantity,
+                'warehouse_code': warehouse_code
+            })
+        return rows
+    
+    def store_product(self, product_data: Dict, commit: bool = True) -> bool:
+        """
+        Store product/SKU in database (commit=False stages it for flush_batch())
+        
+        One INSERT ... ON CONFLICT(sku) DO UPDATE: a new SKU gets zero
+        dimensions by default, an existing one only has the fields present
+        in product_data overwritten.
+        """
         try:
-            sku = line_data.get('SKU', '')
+            sku = product_data.get('sku', '')
             if not sku:
                 return False
             
-            # Find or create product
-            product = Product.query.filter_by(sku=sku).first()
-            
-            line = OrderLine(
-                order_id=order_id,
-                product_id=product.id if product else None,
+            fields = ('description', 'length', 'width', 'height', 'cbm', 'weight', 'barcode')
+            upsert = self._upsert_insert(Product.__table__).values(
                 sku=sku,
-                quantity=line_data.get('Quantity', 0),
-                warehouse_code=warehouse_code
+                description=product_data.get('description'),
+                length=product_data.get('length', 0),
+                width=product_data.get('width', 0),
+                height=product_data.get('height', 0),
+                cbm=product_data.get('cbm', 0),
+                weight=product_data.get('weight', 0),
+                barcode=product_data.get('barcode'),
+                updated_at=datetime.utcnow()
+            )
+            upsert = upsert.on_conflict_do_update(
+                index_elements=['sku'],
+                set_={
+                    column: upsert.excluded[column]
+                    for column in fields + ('updated_at',)
+                    if column in product_data or column == 'updated_at'
+                }
             )
             
-            self.db.session.add(line)
-            self.db.session.commit()
+            with self.db.session.begin_nested():
+                self.db.session.execute(upsert)
+            
+            # The SKU may be new, so the index has to be re-read
+            self._sku_index = None
+            
+            if commit:
+                self.db.session.commit()
             return True
             
         except Exception as e:
-            logger.error(f"Failed to store order line: {e}")
-            self.db.session.rollback()
+            logger.error(f"Failed to store product: {e}")
+            if commit:
+                self.db.session.rollback()
+                self._end_batch()
             return False
     
-    def store_product(self, product_data: Dict) -> bool:
-        """Store product/SKU in database"""
+    def flush_batch(self) -> bool:
+        """Commit everything staged with commit=False as one transaction"""
         try:
-            sku = product_data.get('sku', '')
-            if not sku:
-                return False
-            
-            # Check if product exists
-            product = Product.query.filter_by(sku=sku).first()
-            
-            if product:
-                # Update existing
-                product.description = product_data.get('description', product.description)
-                product.length = product_data.get('length', product.length)
-                product.width = product_data.get('width', product.width)
-                product.height = product_data.get('height', product.height)
-                product.cbm = product_data.get('cbm', product.cbm)
-                product.weight = product_data.get('weight', product.weight)
-                product.barcode = product_data.get('barcode', product.barcode)
-                product.updated_at = datetime.utcnow()
-            else:
-                # Create new
-                product = Product(
-                    sku=sku,
-                    description=product_data.get('description'),
-                    length=product_data.get('length', 0),
-                    width=product_data.get('width', 0),
-                    height=product_data.get('height', 0),
-                    cbm=product_data.get('cbm', 0),
-                    weight=product_data.get('weight', 0),
-                    barcode=product_data.get('barcode')
-                )
-                self.db.session.add(product)
-            
             self.db.session.commit()
             return True
             
         except Exception as e:
-            logger.error(f"Failed to store product: {e}")
+            logger.error(f"Failed to commit batch: {e}")
             self.db.session.rollback()
             return False
+        
+        finally:
+            self._end_batch()
     
     def update_stock_levels(self, stock_data: List[Dict]) -> int:
-        """Update stock levels from Cin7 data"""
+        """Update stock levels from Cin7 data (one upsert on sku + warehouse, one commit)"""
+        now = datetime.utcnow()
+        rows = {}
         updated_count = 0
         
         for item in stock_data:
-            try:
-                sku = item.get('sku', '')
-                warehouse = item.get('warehouse', 'UNKNOWN')
-                
-                if not sku:
-                    continue
-                
-                # Find or create stock level record
-                stock = StockLevel.query.filter_by(
-                    sku=sku,
-                    warehouse_code=warehouse
-                ).first()
-                
-                if stock:
-                    stock.on_hand = item.get('on_hand', 0)
-                    stock.available = item.get('available', 0)
-                    stock.allocated = item.get('allocated', 0)
-                    stock.last_updated = datetime.utcnow()
-                else:
-                    stock = StockLevel(
-                        sku=sku,
-                        warehouse_code=warehouse,
-                        on_hand=item.get('on_hand', 0),
-                        available=item.get('available', 0),
-                        allocated=item.get('allocated', 0)
-                    )
-                    self.db.session.add(stock)
-                
-                self.db.session.commit()
-                updated_count += 1
-                
-            except Exception as e:
-                logger.error(f"Failed to update stock level for {sku}: {e}")
-                self.db.session.rollback()
+            sku = item.get('sku', '')
+            if not sku:
+                continue
+            
+            warehouse = item.get('warehouse', 'UNKNOWN')
+            
+            # A repeated SKU/warehouse keeps its last values, as when rows were applied one by one
+            rows[(sku, warehouse)] = {
+                'sku': sku,
+                'warehouse_code': warehouse,
+                'on_hand': item.get('on_hand', 0),
+                'available': item.get('available', 0),
+                'allocated': item.get('allocated', 0),
+                'last_updated': now
+            }
+            updated_count += 1
+        
+        if not rows:
+            return 0
+        
+        try:
+            stock_insert = self._upsert_insert(StockLevel.__table__)
+            upsert = stock_insert.on_conflict_do_update(
+                index_elements=['sku', 'warehouse_code'],
+                set_={column: stock_insert.excluded[column]
+                      for column in ('on_hand', 'available', 'allocated', 'last_updated')}
+            )
+            
+            self.db.session.execute(upsert, list(rows.values()))
+            self.db.session.commit()
+            
+        except Exception as e:
+            logger.error(f"Failed to update stock levels: {e}")
+            self.db.session.rollback()
+            return 0
         
         return updated_count
     
     def calculate_stock_by_warehouse(self, stock_data: List[Dict]) -> Dict:
         """Group stock data by warehouse"""
-        warehouse_stock = {
-            'VIC': {},
-            'QLD': {},
-            'NSW': {},
-            'TOTAL': {}
-        }
-        
         # First, update the database
         self.update_stock_levels(stock_data)
         
-        # Then aggregate by warehouse
+        # Then aggregate by warehouse in a single pass
+        warehouse_stock = {code: defaultdict(int) for code in ('VIC', 'QLD', 'NSW', 'TOTAL')}
+        
         for item in stock_data:
             sku = item.get('sku', '')
-            warehouse = item.get('warehouse', 'UNKNOWN')
-            on_hand = item.get('on_hand', 0)
-            
             if not sku:
                 continue
             
+            on_hand = item.get('on_hand', 0)
+            
             # Add to specific warehouse
-            if warehouse in warehouse_stock:
-                if sku not in warehouse_stock[warehouse]:
-                    warehouse_stock[warehouse][sku] = 0
-                warehouse_stock[warehouse][sku] += on_hand
+            by_sku = warehouse_stock.get(item.get('warehouse', 'UNKNOWN'))
+            if by_sku is not None:
+                by_sku[sku] += on_hand
             
             # Add to total
-            if sku not in warehouse_stock['TOTAL']:
-                warehouse_stock['TOTAL'][sku] = 0
             warehouse_stock['TOTAL'][sku] += on_hand
         
-        return warehouse_stock
+        return {code: dict(by_sku) for code, by_sku in warehouse_stock.items()}
     
     def get_stock_on_hand(self, sku: str) -> Dict:
         """Get current stock levels for a SKU across all warehouses"""
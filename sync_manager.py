@@ -66,6 +66,11 @@ class SyncManager:
             )
         ''')
         
+        # Covering indexes for the stock_app reads: per-SKU velocity over a date
+        # range (optionally one warehouse), and date-window aggregates across SKUs
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_sku_date_wh ON orders(sku, booking_date, warehouse, quantity)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_date_wh_sku ON orders(booking_date, warehouse, sku, quantity)')
+        
         # Warehouses lookup
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS warehouses (
@@ -90,6 +95,9 @@ class SyncManager:
             VALUES (?, ?)
         ''', ('cin7_orders', (datetime.now() - timedelta(days=7)).isoformat()))
         
+        # Planner statistics so the new indexes are chosen
+        cursor.execute('ANALYZE')
+        
         conn.commit()
         conn.close()
     